@@ -0,0 +1,161 @@
+import ast
+import importlib
+import os
+import random
+import sys
+import time
+from collections import deque
+
+# Usage: python Benchmarks.py lowlevel|costmatrix [checkoutDir ...]
+# lowlevel times the low-level searches (states/s), costmatrix the k-best cost matrices of a subproblem, for each
+# checkout given (this one by default), e.g. worktrees of a commit and of its parent made by git worktree. The results
+# of the checkouts are compared on the same inputs
+REPO_MODULES = ["LowLevelPlan", "NodeStateConstClasses", "GridGraph", "SolverIO", "kBestSequencingBase",
+                "kBestSequencing", "kBestSequencingWithGLKH"]
+
+
+####################################################### Load a checkout ######################################################################
+def load_modules(repoDir, names):
+    # Import names from the checkout at repoDir, leaving the modules already imported from other checkouts untouched
+    saved = {name: sys.modules.pop(name) for name in REPO_MODULES if name in sys.modules}
+    sys.path.insert(0, repoDir)
+    try:
+        return [importlib.import_module(name) for name in names]
+    finally:
+        sys.path.remove(repoDir)
+        for name in REPO_MODULES:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+
+
+def create_map(map_name):
+    with open(f"Maps/{map_name}.map", "r") as file:
+        lines = file.readlines()
+    map_lines = lines[lines.index("map\n") + 1:]
+
+    currMap = []
+    rows, cols = 0, 0
+    for line in map_lines:
+        cols = len(line.strip())
+        rows += 1
+        currMap += [0 if char == "." else 1 for char in line.strip()]
+
+    return {"Rows": rows, "Cols": cols, "Map": currMap}
+
+
+####################################################### Low level searches ###################################################################
+def random_map(rng, rows, cols, density):
+    return {"Rows": rows, "Cols": cols, "Map": [1 if rng.random() < density else 0 for _ in range(rows * cols)]}
+
+
+def bfs_costs(MapAndDims):
+    # Shortest distances between every pair of free cells, as cost_without_rotations holds them
+    rows, cols, grid = MapAndDims["Rows"], MapAndDims["Cols"], MapAndDims["Map"]
+    costs = {}
+    for source in (loc for loc in range(rows * cols) if grid[loc] == 0):
+        dist = {source: 0}
+        queue = deque([source])
+        while queue:
+            loc = queue.popleft()
+            for move in (1, -1, cols, -cols):
+                nextLoc = loc + move
+                if (0 <= nextLoc < rows * cols and grid[nextLoc] == 0 and nextLoc not in dist
+                        and not (abs(move) == 1 and nextLoc // cols != loc // cols)):
+                    dist[nextLoc] = dist[loc] + 1
+                    queue.append(nextLoc)
+        for loc, cost in dist.items():
+            costs[source, loc] = cost
+    return costs
+
+
+def run_searches(lowLevelPlan, nodeStateConstClasses, MapAndDims, costs, algorithm, cases):
+    # Plan every (start position, sequence, negative constraints) case with a fresh planner, returning the paths,
+    # the seconds taken and the expansions (0 for planners that do not count them)
+    paths, seconds, expanded = [], 0.0, 0
+    for startPosition, sequence, neg in cases:
+        planner = lowLevelPlan.LowLevelPlan(MapAndDims, [startPosition], costs, algorithm)
+        N = nodeStateConstClasses.Node()
+        N.sequence = {"Allocations": {0: sequence}}
+        N.negConstraints[0] = set(neg)
+
+        start = time.perf_counter()
+        solved = planner.runLowLevelPlan(N, [0])
+        seconds += time.perf_counter() - start
+        paths.append(N.paths[0] if solved else None)
+        expanded += getattr(planner, "Counter_Expanded_States", 0)
+    return paths, seconds, expanded
+
+
+def benchmark_low_level(checkoutDirs):
+    # 12 searches on a random 32x32 map with 15% obstacles, 5 goals and 30 negative constraints each
+    rng = random.Random(8)
+    MapAndDims = random_map(rng, 32, 32, 0.15)
+    costs = bfs_costs(MapAndDims)
+    free = [loc for loc in range(32 * 32) if MapAndDims["Map"][loc] == 0]
+    cases = []
+    for _ in range(12):
+        sequence = [rng.choice(free)] + rng.sample(free, 5)
+        neg = {(0, rng.choice(free), rng.randint(1, 80)) for _ in range(30)}
+        cases.append(((sequence[0], rng.randrange(4)), sequence, neg))
+
+    checkouts = [(checkoutDir, load_modules(checkoutDir, ["LowLevelPlan", "NodeStateConstClasses"]))
+                 for checkoutDir in checkoutDirs]
+    for algorithm in ["RCbssEff", "IRC"]:
+        results = [(checkoutDir, *run_searches(*modules, MapAndDims, costs, algorithm, cases))
+                   for checkoutDir, modules in checkouts]
+        for checkoutDir, paths, seconds, expanded in results:
+            # A planner that does not count its expansions is credited with those of one finding the same paths
+            expanded = expanded or max((otherExpanded for _, otherPaths, _, otherExpanded in results
+                                        if otherPaths == paths), default=0)
+            states = f", {expanded} expansions ({expanded / seconds:.0f} states/s)" if expanded else ""
+            same = "same" if paths == results[0][1] else "different"
+            print(f"{algorithm} {checkoutDir}: {seconds:.2f} s{states}, {same} paths as {results[0][0]}")
+
+
+####################################################### Cost matrices ########################################################################
+def time_call(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return result, (time.perf_counter() - start) / repeats
+
+
+def benchmark_cost_matrices(checkoutDirs):
+    # 50 agents and 100 goals of den312d instance 0, a subproblem with 20 included and 20 excluded edges
+    with open("Agent_Goal_locations_files/den312d_Map_Agent_Locs_instance_0.txt", "r") as f:
+        Positions = [ast.literal_eval(line.strip()) for _, line in zip(range(50), f)]
+    with open("Agent_Goal_locations_files/den312d_Map_Goal_Locs_instance_0.txt", "r") as f:
+        GoalLocations = [ast.literal_eval(line.strip()) for _, line in zip(range(100), f)]
+    MapAndDims = create_map("den312d")
+
+    rng = random.Random(3)
+    locs = [loc for loc, _ in Positions] + GoalLocations
+    includeE = {(rng.choice(locs), rng.choice(locs)) for _ in range(20)}
+    excludeE = {(rng.choice(locs), rng.choice(locs)) for _ in range(20)}
+
+    names = ["kBestSequencing", "kBestSequencingWithGLKH"]
+    checkouts = [(checkoutDir, load_modules(checkoutDir, names)) for checkoutDir in checkoutDirs]
+    # The solvers of this checkout hold every precomputed cost the methods of the checkouts read
+    current = load_modules(os.path.dirname(os.path.abspath(__file__)), names)
+    for index, (className, baseMethod, method) in enumerate([
+            ("kBestSequencing", "Create_Base_Cost_Matrix", "Create_Cost_Matrix"),
+            ("kBestSequencingWithGLKH", "create_base_cost_matrices", "create_cost_matrix")]):
+        solver = getattr(current[index], className)(Positions, GoalLocations, MapAndDims, "benchmark")
+        firstCmat = None
+        for checkoutDir, modules in checkouts:
+            cls = getattr(modules[index], className)
+            base = ""
+            if hasattr(cls, baseMethod):
+                _, baseSeconds = time_call(lambda: getattr(cls, baseMethod)(solver), 3)
+                base = f", base built once in {baseSeconds * 1e3:.1f} ms"
+            cmat, seconds = time_call(lambda: getattr(cls, method)(solver, includeE, excludeE), 5)
+            firstCmat = cmat if firstCmat is None else firstCmat
+            same = "same" if (cmat == firstCmat).all() else "different"
+            print(f"{className} {cmat.shape} {checkoutDir}: {seconds * 1e3:.2f} ms per subproblem{base}, "
+                  f"{same} matrix as {checkouts[0][0]}")
+        solver.close()
+
+
+if __name__ == "__main__":
+    benchmarks = {"lowlevel": benchmark_low_level, "costmatrix": benchmark_cost_matrices}
+    benchmarks[sys.argv[1]](sys.argv[2:] or [os.path.dirname(os.path.abspath(__file__))])
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Simulations and ticks covered by one pre-generated block of delay samples
+SIMS_PER_BLOCK = 64
+TICKS_PER_BLOCK = 64
+
+
+# Common random numbers for the delay model, in blocks seeded by (agent, simulation block, tick block), so the
+# samples do not depend on the order or the process they are drawn in
+class DelaySampleProvider:
+    def __init__(self, delaysProb, seed, maxBlocks=4096):
+        self.delaysProb = delaysProb
+        self.seed = seed
+        self.maxBlocks = maxBlocks
+        self.blocks = {}
+
+    def block(self, agent, simBlock, tickBlock):
+        key = (agent, simBlock, tickBlock)
+        moves = self.blocks.get(key)
+        if moves is None:
+            randGen = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=key))
+            # An agent moves at a tick if its uniform draw exceeds its delay probability
+            moves = randGen.random((SIMS_PER_BLOCK, TICKS_PER_BLOCK)) > self.delaysProb[agent]
+
+            # Drop the oldest block once the cache is full, it can be regenerated identically
+            if len(self.blocks) >= self.maxBlocks:
+                del self.blocks[next(iter(self.blocks))]
+            self.blocks[key] = moves
+        return moves
+
+    def moves(self, agents, firstSim, numSims, firstTick, numTicks):
+        # (numSims, numTicks, agents) boolean matrix of the moves of the simulations and ticks starting at
+        # firstSim and firstTick
+        result = np.empty((numSims, numTicks, len(agents)), dtype=bool)
+        lastSim, lastTick = firstSim + numSims, firstTick + numTicks
+
+        for col, agent in enumerate(agents):
+            for simBlock in range(firstSim // SIMS_PER_BLOCK, (lastSim - 1) // SIMS_PER_BLOCK + 1):
+                sim0 = max(firstSim, simBlock * SIMS_PER_BLOCK)
+                sim1 = min(lastSim, (simBlock + 1) * SIMS_PER_BLOCK)
+
+                for tickBlock in range(firstTick // TICKS_PER_BLOCK, (lastTick - 1) // TICKS_PER_BLOCK + 1):
+                    tick0 = max(firstTick, tickBlock * TICKS_PER_BLOCK)
+                    tick1 = min(lastTick, (tickBlock + 1) * TICKS_PER_BLOCK)
+
+                    block = self.block(agent, simBlock, tickBlock)
+                    result[sim0 - firstSim:sim1 - firstSim, tick0 - firstTick:tick1 - firstTick, col] = \
+                        block[sim0 - simBlock * SIMS_PER_BLOCK:sim1 - simBlock * SIMS_PER_BLOCK,
+                              tick0 - tickBlock * TICKS_PER_BLOCK:tick1 - tickBlock * TICKS_PER_BLOCK]
+
+        return result
+
+    def agent_moves(self, agent, sim, tick):
+        # Single sample, for simulators stepping through the agents one at a time
+        return bool(self.block(agent, sim // SIMS_PER_BLOCK, tick // TICKS_PER_BLOCK)[sim % SIMS_PER_BLOCK,
+                                                                                      tick % TICKS_PER_BLOCK])
@@ -1,7 +1,9 @@
-import heapq
 import random
+from collections import defaultdict
 from itertools import combinations
 
+import numpy as np
+
 
 def create_loc_times(path):
     locTimes = {}
@@ -19,45 +21,100 @@ def create_edge_times(path):
     return edgeTimes
 
 
+def first_pairs(keys, agents):
+    # For every key shared by several agents, the two smallest agents holding it
+    order = np.lexsort((agents, keys))
+    keys, agents = keys[order], agents[order]
+    firsts = np.flatnonzero((keys[1:] == keys[:-1]) & np.r_[True, keys[1:-1] != keys[:-2]])
+    return agents[firsts], agents[firsts + 1]
+
+
+def first_conflict_without_delays(paths):
+    # First conflict of the paths executed without delays, in agent pair order: the smallest (time, loc) vertex
+    # conflict of the pair, otherwise its first swap conflict. Finished agents occupy no location
+    agents = list(paths.keys())
+    if len(agents) < 2:
+        return None
+
+    lengths = [len(paths[agent]) for agent in agents]
+    locsArray = -np.arange(1, len(agents) + 1)[:, None] * np.ones(max(lengths), dtype=np.int64)
+    for row, agent in enumerate(agents):
+        locsArray[row, :lengths[row]] = [loc for loc, _ in paths[agent]]
+
+    # Shifted locations are positive, with the padding values below the real locations
+    shifted = locsArray + len(agents) + 1
+    maxValue = int(shifted.max()) + 1
+    times = np.arange(locsArray.shape[1])
+    rows = np.broadcast_to(np.arange(len(agents))[:, None], locsArray.shape)
+
+    # Vertex conflicts: agents sharing a (time, loc) key
+    firstAgents, secondAgents = first_pairs((times * maxValue + shifted).ravel(), rows.ravel())
+
+    # Swap conflicts: agents sharing an undirected edge at the same time, traversed in opposite directions
+    fromLocs, toLocs = shifted[:, :-1], shifted[:, 1:]
+    moving = (fromLocs != toLocs) & (locsArray[:, :-1] >= 0) & (locsArray[:, 1:] >= 0)
+    edgeKeys = ((times[1:] * maxValue + np.minimum(fromLocs, toLocs)) * maxValue + np.maximum(fromLocs, toLocs))[moving]
+    forward = (fromLocs < toLocs)[moving]
+    edgeAgents = rows[:, 1:][moving]
+    # After sorting, the smallest agent of each direction sits at the start of its (edge, direction) run
+    order = np.lexsort((edgeAgents, forward, edgeKeys))
+    edgeKeys, forward, edgeAgents = edgeKeys[order], forward[order], edgeAgents[order]
+    runStarts = np.flatnonzero(np.r_[True, (edgeKeys[1:] != edgeKeys[:-1]) | (forward[1:] != forward[:-1])])
+    opposite = np.flatnonzero(edgeKeys[runStarts[1:]] == edgeKeys[runStarts[:-1]])
+    swapAgents = np.stack((edgeAgents[runStarts[opposite]], edgeAgents[runStarts[opposite + 1]]))
+
+    firstAgents = np.concatenate((firstAgents, swapAgents.min(axis=0)))
+    secondAgents = np.concatenate((secondAgents, swapAgents.max(axis=0)))
+    if firstAgents.size == 0:
+        return None
+
+    best = np.argmin(firstAgents * len(agents) + secondAgents)
+    row1, row2 = int(firstAgents[best]), int(secondAgents[best])
+    agent1, agent2 = agents[row1], agents[row2]
+    locs1, locs2 = locsArray[row1], locsArray[row2]
+
+    vertexTimes = np.flatnonzero(locs1 == locs2)
+    if vertexTimes.size:
+        time = int(vertexTimes[0])
+        return 0, time, None, int(locs1[time]), (agent1, time), (agent2, time)
+
+    swapTimes = np.flatnonzero((locs1[:-1] == locs2[1:]) & (locs1[1:] == locs2[:-1]) & (locs1[:-1] != locs1[1:]))
+    time = int(swapTimes[0]) + 1
+    return 0, time, None, frozenset((int(locs1[time - 1]), int(locs1[time]))), (agent1, time), (agent2, time)
+
+
 def findConflictWithoutDelays(N):
-    for agent1, agent2 in combinations(N.paths.keys(), 2):
-        path1 = N.paths[agent1]
-        path2 = N.paths[agent2]
-
-        # Create loc-time dictionaries
-        locTimes1 = set()
-        for i, (loc, _) in enumerate(path1):
-            locTimes1.add((i, loc))
-
-        locTimes2 = set()
-        for i, (loc, _) in enumerate(path2):
-            locTimes2.add((i, loc))
-
-        # Detect location conflicts
-        common_locs = locTimes1 & locTimes2
-        if len(common_locs) != 0:
-            time, loc = min(common_locs)
-            return 0, time, None, loc, (agent1, time), (agent2, time)
-
-        edgeTimes1 = set()
-        for i in range(len(path1) - 1):
-            if path1[i][0] != path1[i + 1][0]:
-                edge = (path1[i][0], path1[i + 1][0])
-                edgeTimes1.add((i + 1, edge))
-
-        edgeTimes2 = set()
-        for i in range(len(path2) - 1):
-            if path2[i][0] != path2[i + 1][0]:
-                edge = (path2[i][0], path2[i + 1][0])
-                edgeTimes2.add((i + 1, edge))
-
-        # Detect edge conflicts, including reversed edges
-        for time, edge1 in edgeTimes1:
-            reversed_edge1 = (edge1[1], edge1[0])
-            if (time, reversed_edge1) in edgeTimes2:
-                return 0, time, None, frozenset(edge1), (agent1, time), (agent2, time)
-
-    return None
+    return first_conflict_without_delays(N.paths)
+
+
+def shared_agent_pairs(locTimes):
+    # Pairs of agents visiting a common location, found through a location index rather than by testing every pair
+    locIndex = defaultdict(list)
+    for agent, agentLocTimes in locTimes.items():
+        for loc in agentLocTimes:
+            locIndex[loc].append(agent)
+
+    pairs = {}
+    for agents in locIndex.values():
+        for pair in combinations(agents, 2):
+            pairs[pair] = True
+    return pairs
+
+
+def pair_conflicts(agent1, agent2, locTimes, edgeTimes):
+    # Yield (delta, Time, (x, (agent1, time1), (agent2, time2))) for the first visits of every shared location
+    # and every edge the two agents traverse in opposite directions
+    locTimes1, locTimes2 = locTimes[agent1], locTimes[agent2]
+    for loc in locTimes1.keys() & locTimes2.keys():
+        time1, time2 = locTimes1[loc], locTimes2[loc]
+        yield abs(time1 - time2), min(time1, time2), (loc, (agent1, time1), (agent2, time2))
+
+    edgeTimes2 = edgeTimes[agent2]
+    for edge1, time1 in edgeTimes[agent1].items():
+        reversed_edge1 = (edge1[1], edge1[0])
+        if reversed_edge1 in edgeTimes2:
+            time2 = edgeTimes2[reversed_edge1]
+            yield abs(time1 - time2), min(time1, time2), (frozenset(edge1), (agent1, time1), (agent2, time2))
 
 
 class FindConflict:
@@ -72,52 +129,55 @@ class FindConflict:
             return findConflictWithoutDelays(N)
 
     def findConflictWithDelays(self, N):
-        heap = []
-
-        posConstraintsDict = {
-            agent: {
-                (x, (agent1, t1), (agent2, t2)) for agent1, agent2, x, t1, t2 in N.posConstraints[agent]
-            }
-            for agent in N.paths
-        }
-
-        agent_data = {
-            agent: {
-                "locTimes": create_loc_times(N.paths[agent]),
-                "edgeTimes": create_edge_times(N.paths[agent])
-            }
-            for agent in N.paths
-        }
-
-        for agent1, agent2 in combinations(N.paths.keys(), 2):
-            allPosConstDict = posConstraintsDict[agent1] | posConstraintsDict[agent2]
-
-            locTimes1, edgeTimes1 = agent_data[agent1]["locTimes"], agent_data[agent1]["edgeTimes"]
-            locTimes2, edgeTimes2 = agent_data[agent2]["locTimes"], agent_data[agent2]["edgeTimes"]
-
-            for loc in locTimes1.keys() & locTimes2.keys():
-                time1, time2 = locTimes1[loc], locTimes2[loc]
-                delta = abs(time1 - time2)
-                Time = min(time1, time2)
-
-                agent1_time, agent2_time = (Time, Time + delta) if time1 <= time2 else (Time + delta, Time)
-
-                if (loc, (agent1, agent1_time), (agent2, agent2_time)) not in allPosConstDict:
-                    heapq.heappush(heap, (
-                        delta, Time, self.randGen.random(), loc, (agent1, agent1_time), (agent2, agent2_time)))
-
-            for edge1, time1 in edgeTimes1.items():
-                reversed_edge1 = (edge1[1], edge1[0])
-                if reversed_edge1 in edgeTimes2:
-                    time2 = edgeTimes2[reversed_edge1]
-                    delta = abs(time1 - time2)
-                    Time = min(time1, time2)
-
-                    agent1_time, agent2_time = (Time, Time + delta) if time1 <= time2 else (Time + delta, Time)
-
-                    if (frozenset(edge1), (agent1, agent1_time), (agent2, agent2_time)) not in allPosConstDict:
-                        heapq.heappush(heap, (
-                            delta, Time, self.randGen.random(), frozenset(edge1), (agent1, agent1_time),
-                            (agent2, agent2_time)))
-
-        return heapq.heappop(heap) if heap else None
+        # Conflict with the smallest (delta, Time) at first visits, from the pair conflicts kept on the node, which are
+        # recomputed only for the pairs touched since the parent. Ties across pairs are broken at random
+        self.update_conflicts(N)
+        if not N.pairConflicts:
+            return None
+
+        key = min(pairKey for pairKey, _ in N.pairConflicts.values())
+        tied = [conflict for pairKey, conflicts in N.pairConflicts.values() if pairKey == key for conflict in conflicts]
+        x, agent1AndTime, agent2AndTime = tied[0] if len(tied) == 1 else self.randGen.choice(tied)
+        return key[0], key[1], None, x, agent1AndTime, agent2AndTime
+
+    def update_conflicts(self, N):
+        order = {agent: i for i, agent in enumerate(N.paths)}
+
+        # Root nodes build the agents' tables and all the pairs' conflicts at once
+        if N.pairConflicts is None:
+            N.locTimes = {agent: create_loc_times(path) for agent, path in N.paths.items()}
+            N.edgeTimes = {agent: create_edge_times(path) for agent, path in N.paths.items()}
+            N.pairConflicts = {}
+            for agent1, agent2 in shared_agent_pairs(N.locTimes):
+                self.update_pair(N, agent1, agent2)
+
+        # Replanned agents are checked against every other agent, whose tables are inherited unchanged
+        for agent in N.dirtyAgents:
+            N.locTimes[agent] = create_loc_times(N.paths[agent])
+            N.edgeTimes[agent] = create_edge_times(N.paths[agent])
+            for other in N.paths:
+                if other != agent:
+                    self.update_pair(N, *sorted((agent, other), key=order.get))
+
+        # New positive constraints only change the filtering of their own pair
+        for agent1, agent2 in N.dirtyPairs:
+            self.update_pair(N, *sorted((agent1, agent2), key=order.get))
+
+        N.dirtyAgents, N.dirtyPairs = set(), set()
+
+    def update_pair(self, N, agent1, agent2):
+        # Keep the pair's smallest conflicts, skipping those already resolved by a positive constraint
+        posConstraints = {(x, (a1, t1), (a2, t2)) for agent in (agent1, agent2)
+                          for a1, a2, x, t1, t2 in N.posConstraints.get(agent, ())}
+        best, conflicts = None, []
+        for delta, Time, conflict in pair_conflicts(agent1, agent2, N.locTimes, N.edgeTimes):
+            if conflict in posConstraints or (best is not None and (delta, Time) > best):
+                continue
+            if best is None or (delta, Time) < best:
+                best, conflicts = (delta, Time), []
+            conflicts.append(conflict)
+
+        if best is None:
+            N.pairConflicts.pop((agent1, agent2), None)
+        else:
+            N.pairConflicts[(agent1, agent2)] = (best, conflicts)
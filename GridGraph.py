@@ -0,0 +1,50 @@
+import hashlib
+import weakref
+
+import numpy as np
+
+# Moves of the four directions: 0 right, 1 down, 2 left, 3 up
+
+
+# Move rules of a map: neighbours[loc, direction] is the cell reached from loc, -1 if the move leaves the grid or
+# enters an obstacle, and free marks the cells without obstacles. The lists are faster to index cell by cell
+class GridGraph:
+    def __init__(self, MapAndDims):
+        cols, rows = MapAndDims["Cols"], MapAndDims["Rows"]
+        grid = np.asarray(MapAndDims["Map"]).ravel()[:cols * rows]
+        locs = np.arange(cols * rows)
+        self.cols, self.rows = cols, rows
+        self.free = grid == 0
+        self.neighbours = np.full((cols * rows, 4), -1, dtype=np.int32)
+
+        for direct, (move, inRange) in enumerate(((1, locs % cols != cols - 1), (cols, locs + cols < cols * rows),
+                                                  (-1, locs % cols != 0), (-cols, locs - cols >= 0))):
+            valid = inRange & self.free
+            valid[valid] = self.free[locs[valid] + move]
+            self.neighbours[valid, direct] = locs[valid] + move
+
+        self.neighbourList = self.neighbours.tolist()
+        self.freeList = self.free.tolist()
+
+    def loc_neighbours(self, loc):
+        # Cells reachable from loc in one move, in direction order
+        return [neighbour for neighbour in self.neighbourList[loc] if neighbour >= 0]
+
+
+# Graphs of the maps in use, keyed by their dimensions and cells, and dropped once no planner or solver holds them
+graphs = weakref.WeakValueDictionary()
+
+
+def map_key(MapAndDims):
+    cols, rows = MapAndDims["Cols"], MapAndDims["Rows"]
+    free = np.asarray(MapAndDims["Map"]).ravel()[:cols * rows] == 0
+    return rows, cols, hashlib.blake2b(free.tobytes(), digest_size=16).digest()
+
+
+def grid_graph(MapAndDims):
+    # The GridGraph of a map, built on first use and then shared by every module planning on the same map
+    key = map_key(MapAndDims)
+    graph = graphs.get(key)
+    if graph is None:
+        graph = graphs[key] = GridGraph(MapAndDims)
+    return graph
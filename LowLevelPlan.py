@@ -1,27 +1,149 @@
 import heapq
-from NodeStateConstClasses import State
+import multiprocessing
+from collections import OrderedDict, defaultdict
 
+import numpy as np
+
+from GridGraph import grid_graph
+from NodeStateConstClasses import SAFE_FOREVER, ConstraintTable, SearchEntry
+
+
+# Distance of cells from which a goal cannot be reached
+UNREACHABLE = 1000000
+
+
+def rotation_predecessors(neighbours):
+    # predecessors[loc * 4 + direct] lists the states reaching (loc, direct) in one step: the two rotations in place,
+    # and moving forward from the previous cell in direction direct (-1 if there is none)
+    cells = neighbours.shape[0]
+    states = np.arange(cells * 4)
+    predecessors = np.full((cells * 4, 3), -1, dtype=np.int64)
+    predecessors[:, 0] = states - states % 4 + (states - 1) % 4
+    predecessors[:, 1] = states - states % 4 + (states + 1) % 4
+
+    fromLocs, directs = np.nonzero(neighbours >= 0)
+    predecessors[neighbours[fromLocs, directs] * 4 + directs, 2] = fromLocs * 4 + directs
+    return predecessors
+
+
+def bfs_distances(predecessors, sources):
+    # Backward BFS, frontier by frontier, from the sources to every state listed in predecessors
+    dist = np.full(predecessors.shape[0], UNREACHABLE, dtype=np.int32)
+    frontier = np.asarray(sources)
+    dist[frontier] = 0
+
+    step = 0
+    while frontier.size:
+        step += 1
+        reached = predecessors[frontier].ravel()
+        reached = reached[reached >= 0]
+        frontier = np.unique(reached[dist[reached] == UNREACHABLE])
+        dist[frontier] = step
+
+    return dist
+
+
+def rotation_distances(predecessors, goal):
+    # Distances over (loc, direction), flattened to loc * 4 + direction, to reach goal whatever the final direction
+    return bfs_distances(predecessors, goal * 4 + np.arange(4))
+
+
+def loc_distances(neighbours, goal):
+    # Distances over the locations, for agents moving without rotations (moves are reversible on the grid)
+    return bfs_distances(neighbours, [goal])
+
+def conflict_counter(paths, agent):
+    # Number of the other agents' paths a move arriving at time t collides with: being in the same cell (agents stay
+    # in their last cell once their path ends) or swapping cells with them
+    occupied, swaps, parked = defaultdict(int), defaultdict(int), defaultdict(list)
+    for other, path in paths.items():
+        if other == agent or not path:
+            continue
+        for t, (loc, _) in enumerate(path):
+            occupied[t, loc] += 1
+        for t in range(1, len(path)):
+            if path[t - 1][0] != path[t][0]:
+                swaps[t, path[t][0], path[t - 1][0]] += 1
+        parked[path[-1][0]].append(len(path) - 1)
+
+    def collisions(t, loc, loc_after_move):
+        return (occupied.get((t, loc_after_move), 0) + swaps.get((t, loc, loc_after_move), 0) +
+                sum(t > end for end in parked.get(loc_after_move, ())))
+
+    return collisions
+
+# Planner of the process that started the root planning workers, inherited by them when they are forked
+forkedPlanner = None
+
+
+def worker_plan_root_path(agent, sequence):
+    # Unconstrained search for agent, run in a worker, with the expansions it took
+    expandedBefore = forkedPlanner.Counter_Expanded_States
+    path = forkedPlanner.rootSearch()(forkedPlanner.Positions[agent], sequence, ConstraintTable(agent, (), ()))
+    return path, forkedPlanner.Counter_Expanded_States - expandedBefore
 
 ########################################################## Extract path #####################################################3
-def extractPath(state):
+def extractPath(expandedStates, expandedParents, index, decode):
+    # Follow the parent indices from the final expansion back to the start, then reverse once
     path = []
-    while state is not None:
-        path.insert(0, state.CurPosition)
-        state = state.parent
+    while index != -1:
+        path.append(decode(expandedStates[index]))
+        index = expandedParents[index]
+    path.reverse()
+    return path
+
+def extractSippPath(expandedStates, expandedParents, index):
+    # Rebuild the path from (loc, direction, arrival time) expansions, waiting in place between consecutive ones
+    chain = []
+    while index != -1:
+        chain.append(expandedStates[index])
+        index = expandedParents[index]
+    chain.reverse()
 
+    path = []
+    for (loc, direct, time), (_, _, nextTime) in zip(chain, chain[1:]):
+        path.extend([(loc, direct)] * (nextTime - time))
+    path.append(chain[-1][:2])
     return path
 
 ########################################################## LowLevelPlan Class #####################################################3
 
 
 class LowLevelPlan:
-    def __init__(self, dict_of_map_and_dim, Positions, dict_cost_for_Heuristic_value, algorithm):
+    def __init__(self, dict_of_map_and_dim, Positions, dict_cost_for_Heuristic_value, algorithm, lowLevelMode="astar",
+                 repairWindow=None, pathCacheSize=4096, conflictAvoidance=False, plannerWorkers=1):
         self.MapAndDims = dict_of_map_and_dim
         self.Positions = Positions
         self.dict_cost_for_Heuristic_value = dict_cost_for_Heuristic_value
 
         self.algorithm = algorithm
+        # Search used by the planner with rotations: "astar" (time-expanded) or "sipp" (safe intervals)
+        self.lowLevelMode = lowLevelMode
+        # Steps of the parent path replanned before a new negative constraint, None replans the whole path
+        self.repairWindow = repairWindow
         self.Counter_LowLevel_For_Test = 0
+        self.Counter_Expanded_States = 0
+        self.Counter_Repairs = 0
+        self.Counter_Repair_Fallbacks = 0
+        # Break ties between equal-f states of the A* searches in favour of fewer collisions with the other paths
+        self.conflictAvoidance = conflictAvoidance
+        # Worker processes sharing the searches of the roots, started on first use when plannerWorkers > 1
+        self.plannerWorkers = plannerWorkers
+        self.pool = None
+
+        # LRU cache of search results keyed by (start position, sequence, constraints), shared by all CBS nodes.
+        # PathCache_Steps is the number of path positions it holds
+        self.pathCacheSize = pathCacheSize
+        self.pathCache = OrderedDict()
+        self.PathCache_Steps = 0
+        self.Counter_PathCache_Hits = 0
+        self.Counter_PathCache_Misses = 0
+
+        # Exact distance tables to every goal, ignoring constraints, computed on first use
+        self.graph = grid_graph(dict_of_map_and_dim)
+        self.predecessors = rotation_predecessors(self.graph.neighbours)
+        self.rotationTables = {}
+        self.locTables = {}
 
     ########################################################## Low level plan #####################################################
 
@@ -31,127 +153,436 @@ class LowLevelPlan:
         else:
             return self.runLowLevelPlanWithoutRotations(Node, agent_that_need_update_path)
 
-    ########################################################## run Low Level Plan With Rotations #####################################################
-    def runLowLevelPlanWithRotations(self, Node, agent_that_need_update_path):
+    def runRootPlan(self, Node, agent_that_need_update_path):
+        # runLowLevelPlan for a root, solving the searches missing from the path cache in the worker processes.
+        # Conflict avoidance makes each search depend on the previous paths, so it stays serial
+        if self.plannerWorkers <= 1 or self.conflictAvoidance or len(agent_that_need_update_path) < 2:
+            return self.runLowLevelPlan(Node, agent_that_need_update_path)
         self.Counter_LowLevel_For_Test += 1
 
+        cacheKeys = {}
         for agent in agent_that_need_update_path:
             sequence = Node.sequence["Allocations"][agent]
+            if len(sequence) > 1:
+                cacheKeys[agent] = (tuple(self.Positions[agent]), tuple(sequence), ConstraintTable(agent, (), ()).key())
+
+        paths = {agent: self.cachedPath(cacheKey) for agent, cacheKey in cacheKeys.items() if cacheKey in self.pathCache}
+        missing = [agent for agent in cacheKeys if agent not in paths]
+        if missing:
+            self.Counter_PathCache_Misses += len(missing)
+            tasks = [(agent, Node.sequence["Allocations"][agent]) for agent in missing]
+            for agent, (path, expanded) in zip(missing, self.get_pool(Node).starmap(worker_plan_root_path, tasks)):
+                self.Counter_Expanded_States += expanded
+                self.storePath(cacheKeys[agent], path)
+                paths[agent] = path
 
+        for agent in agent_that_need_update_path:
             # If no allocations are present
-            if len(sequence) == 1:
+            if agent not in paths:
                 Node.paths[agent] = [self.Positions[agent]]
                 continue
 
             # Decrease the previous path cost of the current agent
             Node.g -= (max(1, len(Node.paths[agent])) - 1)
+            if paths[agent] is None:
+                return False
 
-            findPath = False
-            OpenList = []
-            visited = {}
+            Node.paths[agent] = paths[agent][:]
+            Node.g += (len(Node.paths[agent]) - 1)
+        return True
 
-            S = State(self.Positions[agent], sequence=[self.Positions[agent][0]])
-            heapq.heappush(OpenList, (self.calc_cost_for_Heuristic_value(S, sequence), S))
+    def rootSearch(self):
+        # The search runLowLevelPlan uses for the agents
+        if self.algorithm not in ["RCbssEff", "RCbssBase", "IDP"]:
+            return self.searchWithoutRotations
+        return self.searchSippWithRotations if self.lowLevelMode == "sipp" else self.searchWithRotations
+
+    def get_pool(self, Node):
+        global forkedPlanner
+        if self.pool is None:
+            # Compute the distance tables to every goal of the root first, the forked workers inherit them
+            table = self.rotationTable if self.algorithm in ["RCbssEff", "RCbssBase", "IDP"] else self.locTable
+            for sequence in Node.sequence["Allocations"].values():
+                for goal in sequence[1:]:
+                    table(goal)
+            forkedPlanner = self
+            self.pool = multiprocessing.get_context("fork").Pool(self.plannerWorkers)
+        return self.pool
+
+    def close(self):
+        # Stop the worker processes, if any were started
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def runLowLevelRepair(self, Node, NewCons):
+        # Replan the agent of NewCons = (agent, x, t) from repairWindow steps before t, rejoining the parent path
+        # at a time >= t in the same state. The parent cost does not bound the full replan, so only paths as short
+        # as the unconstrained path are accepted, which the full replan would match, otherwise the whole path is
+        # replanned
+        agent, _, t = NewCons
+        path = Node.paths[agent]
+        if self.repairWindow is None or self.lowLevelMode != "astar" or not 0 < t < len(path):
+            return self.runLowLevelPlan(Node, [agent])
+
+        sequence = Node.sequence["Allocations"][agent]
+        constraints = ConstraintTable(agent, Node.negConstraints[agent], Node.posConstraints[agent])
+        # A problem already solved is read from the path cache by the full replan
+        if (tuple(self.Positions[agent]), tuple(sequence), constraints.key()) in self.pathCache:
+            return self.runLowLevelPlan(Node, [agent])
+
+        rotations = self.algorithm in ["RCbssEff", "RCbssBase", "IDP"]
+        # The unconstrained path, usually cached since the root, bounds the cost of every child path
+        unconstrained = self.cachedSearch(self.searchWithRotations if rotations else self.searchWithoutRotations,
+                                          self.Positions[agent], sequence, ConstraintTable(agent, (), ()))
+        repaired = None
+        if unconstrained is not None:
+            repaired = self.searchRepair(path, sequence, constraints, t, rotations, len(unconstrained) - 1)
+        # Every step of the repaired prefix is checked by the search, this only guards the constraint it repairs
+        if repaired is not None and t < len(repaired) and constraints.is_forbidden(t, repaired[t - 1][0], repaired[t][0]):
+            repaired = None
+        if repaired is None:
+            self.Counter_Repair_Fallbacks += 1
+            return self.runLowLevelPlan(Node, [agent])
 
-            while OpenList:
-                _, S = heapq.heappop(OpenList)
-                loc, direct = S.CurPosition
+        self.Counter_LowLevel_For_Test += 1
+        self.Counter_Repairs += 1
+        Node.g += len(repaired) - len(path)
+        Node.paths[agent] = repaired
+        return True
 
-                if (loc, direct, tuple(S.sequence)) in visited:
-                    continue
-                visited[(loc, direct, tuple(S.sequence))] = True
+    def searchRepair(self, path, sequence, constraints, t, rotations, bound):
+        # Time-expanded A* over (loc, direction, goals reached, time) from the parent path at time t - repairWindow,
+        # with the moves of searchWithRotations (or searchWithoutRotations) and f pruned at bound, a lower bound of
+        # the child path cost. Unlike theirs, waits must satisfy the constraints too, so that every state from time
+        # t on was reached by valid steps before the parent path is rejoined
+        neighbours = self.graph.neighbourList
+        numGoals = len(sequence)
+        if rotations:
+            rotationHeuristic = self.rotationHeuristic(sequence)
+            heuristic = lambda loc, direct, goals: rotationHeuristic(loc * 4 + direct, goals)
+        else:
+            locHeuristic = self.locHeuristic(sequence)
+            heuristic = lambda loc, direct, goals: locHeuristic(loc, goals)
+        # Rejoining keeps the parent cost, which has to be the bound as well
+        canRejoin = len(path) - 1 == bound
+
+        # Goals reached along the parent path, counted as the searches count them
+        reached = [1]
+        for (prevLoc, _), (loc, _) in zip(path, path[1:]):
+            reached.append(reached[-1] + 1 if loc != prevLoc and loc == sequence[reached[-1]] else reached[-1])
+
+        start = max(0, t - max(1, self.repairWindow))
+        startLoc, startDirect = path[start]
+        startState = (startLoc, startDirect, reached[start], start)
+        OpenList = [(heuristic(startLoc, startDirect, reached[start]) + start, start, SearchEntry(startState, -1))]
+        visited = set()
+        expandedStates, expandedParents = [], []
+
+        while OpenList:
+            _, g, entry = heapq.heappop(OpenList)
+            state = entry.state
+            if state in visited:
+                continue
+            visited.add(state)
+
+            expandedStates.append(state)
+            expandedParents.append(entry.parent)
+            current = len(expandedStates) - 1
+
+            loc, direct, goals, _ = state
+            if goals == numGoals or (canRejoin and g >= t and path[g] == (loc, direct) and reached[g] == goals):
+                self.Counter_Expanded_States += len(expandedStates)
+                segment = extractPath(expandedStates, expandedParents, current, lambda expanded: expanded[:2])
+                return path[:start] + segment + (path[g + 1:] if goals < numGoals else [])
+
+            successors = []
+            if rotations:
+                loc_after_move = neighbours[loc][direct]
+                canMove = self.validateMove(loc, loc_after_move, g + 1, constraints)
+                if canMove == 1:
+                    successors.append((loc_after_move, direct, goals + 1 if loc_after_move == sequence[goals] else goals))
+                canStay = self.validateMove(loc, loc, g + 1, constraints) == 1
+                if canStay:
+                    successors.append((loc, (direct - 1) % 4, goals))
+                    successors.append((loc, (direct + 1) % 4, goals))
+                if canMove == -1 and canStay:
+                    successors.append((loc, direct, goals))
+            else:
+                canStay = self.validateMove(loc, loc, g + 1, constraints) == 1
+                stay = False
+                for loc_after_move in neighbours[loc]:
+                    canMove = self.validateMove(loc, loc_after_move, g + 1, constraints)
+                    if canMove == 1:
+                        successors.append((loc_after_move, direct, goals + 1 if loc_after_move == sequence[goals] else goals))
+                    if canMove == -1 and canStay and not stay:
+                        stay = True
+                        successors.append((loc, direct, goals))
+
+            for nextLoc, nextDirect, nextGoals in successors:
+                f = heuristic(nextLoc, nextDirect, nextGoals) + g + 1
+                if f <= bound and (nextLoc, nextDirect, nextGoals, g + 1) not in visited:
+                    heapq.heappush(OpenList, (f, g + 1, SearchEntry((nextLoc, nextDirect, nextGoals, g + 1), current)))
+
+        self.Counter_Expanded_States += len(expandedStates)
+        return None
 
-                if len(S.sequence) == len(sequence):
-                    findPath = True
-                    break
+    ########################################################## run Low Level Plan With Rotations #####################################################
+    def runLowLevelPlanWithRotations(self, Node, agent_that_need_update_path):
+        self.Counter_LowLevel_For_Test += 1
 
-                for Sl in self.GetNeighbors(S, agent, visited, Node, sequence):
-                    loc, direct = Sl.CurPosition
-                    if not visited.get((loc, direct, tuple(Sl.sequence)), False):
-                        heapq.heappush(OpenList, (self.calc_cost_for_Heuristic_value(Sl, sequence) + Sl.g, Sl))
+        for agent in agent_that_need_update_path:
+            sequence = Node.sequence["Allocations"][agent]
 
-            if not findPath:
+            # If no allocations are present
+            if len(sequence) == 1:
+                Node.paths[agent] = [self.Positions[agent]]
+                continue
+
+            # Decrease the previous path cost of the current agent
+            Node.g -= (max(1, len(Node.paths[agent])) - 1)
+
+            constraints = ConstraintTable(agent, Node.negConstraints[agent], Node.posConstraints[agent])
+            if self.lowLevelMode == "sipp":
+                path = self.cachedSearch(self.searchSippWithRotations, self.Positions[agent], sequence, constraints)
+            else:
+                path = self.cachedSearch(self.searchWithRotations, self.Positions[agent], sequence, constraints,
+                                         self.conflictCounter(Node, agent))
+            if path is None:
                 return False
 
-            # Extract the path from the final goal back to the start
-            Node.paths[agent] = extractPath(S)
+            Node.paths[agent] = path
             Node.g += (len(Node.paths[agent]) - 1)
         return True
 
-    ########################################################## calc cost for Heuristic value #####################################################
-    def calc_cost_for_Heuristic_value(self, S, sequence):
-        if len(S.sequence) == len(sequence):
-            return 0
+    def searchWithRotations(self, startPosition, sequence, constraints, avoid=None):
+        # A* over (loc, direction, goals reached) packed into ((goals * cells) + loc) * 4 + direction. With avoid
+        # (see conflict_counter), the heap entries (f, conflicts, g, SearchEntry) also count collisions
+        cells = self.graph.cols * self.graph.rows
+        neighbours = self.graph.neighbourList
+        heuristic = self.rotationHeuristic(sequence)
+        numGoals = len(sequence)
+
+        visited = bytearray((numGoals + 1) * cells * 4)
+        expandedStates, expandedParents = [], []
 
-        nextIndex = len(S.sequence)
-        h_val = self.dict_cost_for_Heuristic_value[S.CurPosition[0], sequence[nextIndex]]
-        return h_val + sum(self.dict_cost_for_Heuristic_value[sequence[i], sequence[i + 1]] for i in range(nextIndex, len(sequence) - 1))
+        startLoc, startDirect = startPosition
+        OpenList = [(heuristic(startLoc * 4 + startDirect, 1), 0, 0, SearchEntry((cells + startLoc) * 4 + startDirect, -1))]
 
-    ########################################################## Get neighbors #####################################################
+        while OpenList:
+            _, conflicts, g, entry = heapq.heappop(OpenList)
+            state = entry.state
+            if visited[state]:
+                continue
+            visited[state] = 1
 
-    def GetNeighbors(self, state, agent, visited, Node, sequence):
-        neighbors = []
-        loc, direct = state.CurPosition
+            expandedStates.append(state)
+            expandedParents.append(entry.parent)
+            current = len(expandedStates) - 1
 
-        # Define movement candidates for the agent
-        direction_moves = (loc + 1, loc + self.MapAndDims["Cols"], loc - 1, loc - self.MapAndDims["Cols"])
+            direct = state & 3
+            goals, loc = divmod(state >> 2, cells)
+            if goals == numGoals:
+                self.Counter_Expanded_States += len(expandedStates)
+                return extractPath(expandedStates, expandedParents, current,
+                                   lambda packed: ((packed >> 2) % cells, packed & 3))
 
-        # Try moving in the current direction
-        loc_after_move = direction_moves[direct]
-        canMove = self.validateMove(loc_after_move, agent, state, Node)
+            successors = []
 
-        if canMove == 1:
-            afterMoveStateSequence = state.sequence + [sequence[len(state.sequence)]] if (
-                    loc_after_move == sequence[len(state.sequence)] and state.sequence == sequence[:len(state.sequence)]
-            ) else state.sequence
+            # Try moving in the current direction
+            loc_after_move = neighbours[loc][direct]
+            canMove = self.validateMove(loc, loc_after_move, g + 1, constraints)
+            if canMove == 1:
+                goalsAfterMove = goals + 1 if loc_after_move == sequence[goals] else goals
+                successors.append((goalsAfterMove, ((goalsAfterMove * cells + loc_after_move) << 2) + direct))
 
-            neighbors.append(State((loc_after_move, direct), state.g + 1, state, afterMoveStateSequence))
+            # Rotate in place
+            if self.validateMove(loc, loc, g + 1, constraints) == 1:
+                successors.append((goals, (state & ~3) + (direct - 1) % 4))
+                successors.append((goals, (state & ~3) + (direct + 1) % 4))
 
-        canStay = self.validateMove(loc, agent, state, Node) == 1
-        if canStay == 1:
-            neighbors.append(State((loc, (direct - 1) % 4), state.g + 1, state, state.sequence[:]))
-            neighbors.append(State((loc, (direct + 1) % 4), state.g + 1, state, state.sequence[:]))
+            # Stay in the same place but increment g (cost)
+            if canMove == -1:
+                successors.append((goals, state))
+                visited[state] = 0
+
+            for nextGoals, nextState in successors:
+                if not visited[nextState]:
+                    nextPosition = nextState - nextGoals * cells * 4
+                    nextConflicts = conflicts + avoid(g + 1, loc, nextPosition >> 2) if avoid else 0
+                    heapq.heappush(OpenList, (heuristic(nextPosition, nextGoals) + g + 1, nextConflicts, g + 1,
+                                              SearchEntry(nextState, current)))
+
+        self.Counter_Expanded_States += len(expandedStates)
+        return None
+
+    def searchSippWithRotations(self, startPosition, sequence, constraints):
+        # Safe-interval path planning over (loc, direction, safe interval, goals reached), each state expanded once
+        # at its earliest arrival. Paths are never longer than those of the time-expanded search
+        heuristic = self.rotationHeuristic(sequence)
+        numGoals = len(sequence)
+        cellIntervals = {}
+
+        def safe_intervals(loc):
+            if loc not in cellIntervals:
+                cellIntervals[loc] = constraints.safe_intervals(loc)
+            return cellIntervals[loc]
+
+        def earliest_arrival(loc, loc_after_move, first, last):
+            # Earliest time in [first, last] at which the move from loc to loc_after_move is allowed
+            for t in range(first, last + 1):
+                if not constraints.is_forbidden(t, loc, loc_after_move) and \
+                        constraints.is_allowed_by_positive(t, loc, loc_after_move):
+                    return t
+            return None
+
+        startLoc, startDirect = startPosition
+        startState = (startLoc, startDirect, 0, 1)
+        OpenList = [(heuristic(startLoc * 4 + startDirect, 1), 0, SearchEntry(startState, -1))]
+        bestArrival = {startState: 0}
+        closed = set()
+        expandedStates, expandedParents = [], []
+
+        while OpenList:
+            _, g, entry = heapq.heappop(OpenList)
+            state = entry.state
+            if state in closed:
+                continue
+            closed.add(state)
+
+            loc, direct, index, goals = state
+            expandedStates.append((loc, direct, g))
+            expandedParents.append(entry.parent)
+            current = len(expandedStates) - 1
+
+            if goals == numGoals:
+                self.Counter_Expanded_States += len(expandedStates)
+                return extractSippPath(expandedStates, expandedParents, current)
+
+            locIntervals = safe_intervals(loc)
+            end = locIntervals[index][1]
+            successors = []
+
+            # Move forward into every safe interval of the next cell reachable before this interval ends
+            loc_after_move = self.graph.neighbourList[loc][direct]
+            if loc_after_move >= 0:
+                goalsAfterMove = goals + 1 if loc_after_move == sequence[goals] else goals
+                for nextIndex, (nextStart, nextEnd) in enumerate(safe_intervals(loc_after_move)):
+                    if nextStart > end + 1:
+                        break
+                    t = earliest_arrival(loc, loc_after_move, max(g + 1, nextStart), min(end + 1, nextEnd))
+                    if t is not None:
+                        successors.append(((loc_after_move, direct, nextIndex, goalsAfterMove), t))
+
+            # Rotate in place
+            if g + 1 <= end:
+                successors.append(((loc, (direct - 1) % 4, index, goals), g + 1))
+                successors.append(((loc, (direct + 1) % 4, index, goals), g + 1))
+
+            # Stay, possibly rotating, into the next safe interval of the cell when it starts right after this one
+            if index + 1 < len(locIntervals) and locIntervals[index + 1][0] == end + 1 and \
+                    earliest_arrival(loc, loc, end + 1, end + 1) is not None:
+                for nextDirect in (direct, (direct - 1) % 4, (direct + 1) % 4):
+                    successors.append(((loc, nextDirect, index + 1, goals), end + 1))
+
+            for nextState, t in successors:
+                if nextState not in closed and t < bestArrival.get(nextState, SAFE_FOREVER):
+                    bestArrival[nextState] = t
+                    nextPosition = nextState[0] * 4 + nextState[1]
+                    heapq.heappush(OpenList, (heuristic(nextPosition, nextState[3]) + t, t, SearchEntry(nextState, current)))
+
+        self.Counter_Expanded_States += len(expandedStates)
+        return None
+
+    ########################################################## Path cache #####################################################
+    def cachedSearch(self, search, startPosition, sequence, constraints, avoid=None):
+        # Run search(startPosition, sequence, constraints) unless the same problem was already solved. Failures are
+        # cached too, and callers get their own copy of the path. Searches avoiding conflicts depend on the other
+        # agents' paths, so they are not cached
+        if avoid is not None:
+            return search(startPosition, sequence, constraints, avoid)
+
+        cacheKey = (tuple(startPosition), tuple(sequence), constraints.key())
+        if cacheKey in self.pathCache:
+            return self.cachedPath(cacheKey)
+        self.Counter_PathCache_Misses += 1
+
+        path = search(startPosition, sequence, constraints)
+        self.storePath(cacheKey, path)
+        return None if path is None else path[:]
+
+    def storePath(self, cacheKey, path):
+        if self.pathCacheSize > 0:
+            self.pathCache[cacheKey] = path
+            self.PathCache_Steps += len(path or ())
+            # Evict the least recently used paths beyond the cache size
+            while len(self.pathCache) > self.pathCacheSize:
+                _, evicted = self.pathCache.popitem(last=False)
+                self.PathCache_Steps -= len(evicted or ())
+
+    def conflictCounter(self, Node, agent):
+        return conflict_counter(Node.paths, agent) if self.conflictAvoidance else None
+
+    def cachedPath(self, cacheKey):
+        self.Counter_PathCache_Hits += 1
+        self.pathCache.move_to_end(cacheKey)
+        path = self.pathCache[cacheKey]
+        return None if path is None else path[:]
 
-        # Stay in the same place but increment g (cost)
-        if canMove == -1:
-            neighbors.append(State((loc, direct), state.g + 1, state, state.sequence[:]))
-            del visited[(loc, direct, tuple(state.sequence))]
+    ########################################################## calc cost for Heuristic value #####################################################
+    def rotationHeuristic(self, sequence):
+        # Distance with turns to the next goal, plus the distance of each remaining leg from its best arrival direction
+        tables = [None] + [memoryview(self.rotationTable(goal)) for goal in sequence[1:]]
+        remaining = [0] * len(sequence)
+        for i in range(len(sequence) - 2, 0, -1):
+            remaining[i] = remaining[i + 1] + min(tables[i + 1][sequence[i] * 4 + direct] for direct in range(4))
+
+        def heuristic(position, goals):
+            if goals == len(sequence):
+                return 0
+            return tables[goals][position] + remaining[goals]
 
-        return neighbors
+        return heuristic
 
-    ########################################################## validate Move #####################################################
-    def validateMove(self, loc_after_move, agent, state, Node):
-        # Extract the agent's location and direction before taking the next step
-        loc, _ = state.CurPosition
-        cols, rows = self.MapAndDims["Cols"], self.MapAndDims["Rows"]
-        max_cells = cols * rows
-
-        # If the agent is at the top or bottom boundary, it cannot move up or down
-        if not (0 <= loc_after_move < max_cells):
-            return 0
+    def locHeuristic(self, sequence):
+        # Heuristic of the planner without rotations at loc: distance to the next goal plus the remaining legs
+        tables = [None] + [memoryview(self.locTable(goal)) for goal in sequence[1:]]
+        remaining = [0] * len(sequence)
+        for i in range(len(sequence) - 2, 0, -1):
+            remaining[i] = remaining[i + 1] + tables[i + 1][sequence[i]]
 
-        col_loc = loc % cols
-        col_after = loc_after_move % cols
+        def heuristic(loc, goals):
+            if goals == len(sequence):
+                return 0
+            return tables[goals][loc] + remaining[goals]
 
-        if (col_loc == 0 and col_after == cols - 1) or (col_loc == cols - 1 and col_after == 0):
-            return 0
+        return heuristic
 
-        if self.MapAndDims["Map"][loc_after_move] != 0:
+    def rotationTable(self, goal):
+        if goal not in self.rotationTables:
+            self.rotationTables[goal] = rotation_distances(self.predecessors, goal)
+        return self.rotationTables[goal]
+
+    def locTable(self, goal):
+        if goal not in self.locTables:
+            self.locTables[goal] = loc_distances(self.graph.neighbours, goal)
+        return self.locTables[goal]
+
+    ########################################################## validate Move #####################################################
+    def validateMove(self, loc, loc_after_move, t, constraints):
+        # Whether the agent at loc can be at loc_after_move at time t: 1 if so, -1 if a negative constraint blocks
+        # it (the agent may then wait), 0 otherwise. loc_after_move is loc itself or its neighbour in the grid graph,
+        # -1 when the move leaves the grid or enters an obstacle
+        if loc_after_move < 0:
             return 0
 
         # Check if the move violates any negative constraints
-        for z, x, t in Node.negConstraints[agent]:
-            if t == state.g + 1 and (x == loc_after_move or x == frozenset((loc, loc_after_move))):
-                return -1
-
-        for agent1, agent2, x, t1, t2 in Node.posConstraints[agent]:
-            if agent1 == agent and t1 == state.g + 1 and (
-                    x != loc_after_move and x != frozenset((loc, loc_after_move))):
-                return 0
+        if constraints.is_forbidden(t, loc, loc_after_move):
+            return -1
 
-            elif agent2 == agent and t2 == state.g + 1 and (
-                    x != loc_after_move and x != frozenset((loc, loc_after_move))):
-                return 0
+        if not constraints.is_allowed_by_positive(t, loc, loc_after_move):
+            return 0
 
         return 1
 
@@ -171,61 +602,66 @@ class LowLevelPlan:
             # Decrease the previous path cost of the current agent
             Node.g -= (max(1, len(Node.paths[agent])) - 1)
 
-            findPath = False
-            OpenList = []
-            visited = {}
-
-            S = State(self.Positions[agent], sequence=[self.Positions[agent][0]])
-            heapq.heappush(OpenList, (self.calc_cost_for_Heuristic_value(S, sequence), S))
-
-            while OpenList:
-                _, S = heapq.heappop(OpenList)
-                loc, _ = S.CurPosition
-
-                if (loc, tuple(S.sequence)) in visited:
-                    continue
-                visited[(loc, tuple(S.sequence))] = True
-
-                if len(S.sequence) == len(sequence):
-                    findPath = True
-                    break
-
-                for Sl in self.GetNeighborsWithoutRotations(S, agent, visited, Node, sequence):
-                    loc, _ = Sl.CurPosition
-                    if not visited.get((loc, tuple(Sl.sequence)), False):
-                        heapq.heappush(OpenList, (self.calc_cost_for_Heuristic_value(Sl, sequence) + Sl.g, Sl))
-
-            if not findPath:
+            constraints = ConstraintTable(agent, Node.negConstraints[agent], Node.posConstraints[agent])
+            path = self.cachedSearch(self.searchWithoutRotations, self.Positions[agent], sequence, constraints,
+                                     self.conflictCounter(Node, agent))
+            if path is None:
                 return False
 
-            # Extract the path from the final goal back to the start
-            Node.paths[agent] = extractPath(S)
+            Node.paths[agent] = path
             Node.g += (len(Node.paths[agent]) - 1)
         return True
 
-    def GetNeighborsWithoutRotations(self, state, agent, visited, Node, sequence):
-        neighbors = []
-        loc, _ = state.CurPosition
-        stay = False
+    def searchWithoutRotations(self, startPosition, sequence, constraints, avoid=None):
+        # Same search as searchWithRotations over (loc, goals reached), packed into goals * cells + loc. The agent
+        # keeps its initial direction along the whole path
+        cells = self.graph.cols * self.graph.rows
+        neighbours = self.graph.neighbourList
+        heuristic = self.locHeuristic(sequence)
+        numGoals = len(sequence)
 
-        # Define movement candidates for the agent
-        direction_moves = (loc + 1, loc + self.MapAndDims["Cols"], loc - 1, loc - self.MapAndDims["Cols"])
+        visited = bytearray((numGoals + 1) * cells)
+        expandedStates, expandedParents = [], []
 
-        for loc_after_move in direction_moves:
-            canMove = self.validateMove(loc_after_move, agent, state, Node)
-
-            if canMove == 1:
-                afterMoveStateSequence = state.sequence + [sequence[len(state.sequence)]] if (
-                        loc_after_move == sequence[len(state.sequence)] and state.sequence == sequence[
-                                                                                              :len(state.sequence)]
-                ) else state.sequence
+        startLoc, startDirect = startPosition
+        OpenList = [(heuristic(startLoc, 1), 0, 0, SearchEntry(cells + startLoc, -1))]
 
-                neighbors.append(State((loc_after_move, _), state.g + 1, state, afterMoveStateSequence))
-
-            # Stay in the same place but increment g (cost)
-            if canMove == -1 and not stay:
-                stay = True
-                neighbors.append(State((loc, _), state.g + 1, state, state.sequence[:]))
-                del visited[(loc, tuple(state.sequence))]
-
-        return neighbors
+        while OpenList:
+            _, conflicts, g, entry = heapq.heappop(OpenList)
+            state = entry.state
+            if visited[state]:
+                continue
+            visited[state] = 1
+
+            expandedStates.append(state)
+            expandedParents.append(entry.parent)
+            current = len(expandedStates) - 1
+
+            goals, loc = divmod(state, cells)
+            if goals == numGoals:
+                self.Counter_Expanded_States += len(expandedStates)
+                return extractPath(expandedStates, expandedParents, current, lambda packed: (packed % cells, startDirect))
+
+            successors = []
+            stay = False
+            for loc_after_move in neighbours[loc]:
+                canMove = self.validateMove(loc, loc_after_move, g + 1, constraints)
+
+                if canMove == 1:
+                    goalsAfterMove = goals + 1 if loc_after_move == sequence[goals] else goals
+                    successors.append((goalsAfterMove, loc_after_move, goalsAfterMove * cells + loc_after_move))
+
+                # Stay in the same place but increment g (cost)
+                if canMove == -1 and not stay:
+                    stay = True
+                    successors.append((goals, loc, state))
+                    visited[state] = 0
+
+            for nextGoals, nextLoc, nextState in successors:
+                if not visited[nextState]:
+                    nextConflicts = conflicts + avoid(g + 1, loc, nextLoc) if avoid else 0
+                    heapq.heappush(OpenList, (heuristic(nextLoc, nextGoals) + g + 1, nextConflicts, g + 1,
+                                              SearchEntry(nextState, current)))
+
+        self.Counter_Expanded_States += len(expandedStates)
+        return None
@@ -11,6 +11,14 @@ class Node:
         self.sequence = {}
         self.isPositiveNode = False
 
+        # Conflict tables of FindConflict: loc/edge first-visit times per agent and the smallest conflicts per pair
+        # of agents, inherited by the children, which record the agents and pairs to recompute (None: build them all)
+        self.locTimes = {}
+        self.edgeTimes = {}
+        self.pairConflicts = None
+        self.dirtyAgents = set()
+        self.dirtyPairs = set()
+
     def __lt__(self, other):
         return self.g < other.g
 
@@ -40,3 +48,84 @@ class State:
     # Define less-than for ordering, based on cost g
     def __lt__(self, other):
         return self.g < other.g
+
+
+# Payload of a low-level heap entry (f, g, SearchEntry): a packed state and its parent's expansion index.
+# Never smaller than another entry, so equal (f, g) keep the heap order, as with State
+class SearchEntry:
+    __slots__ = ("state", "parent")
+
+    def __init__(self, state, parent):
+        self.state = state
+        self.parent = parent
+
+    def __lt__(self, other):
+        return False
+
+
+def edge_moves(edge):
+    # The (from, to) moves traversing an undirected edge, given as a frozenset of its locations
+    return {(loc1, loc2) for loc1 in edge for loc2 in edge if loc1 != loc2 or len(edge) == 1}
+
+
+# End of the last safe interval of a location
+SAFE_FOREVER = 10 ** 9
+
+
+# An agent's constraints indexed by timestep: negative (t, loc) and (t, from, to) entries, edges in both directions,
+# and per timestep the moves accepted by each positive constraint
+class ConstraintTable:
+    def __init__(self, agent, negConstraints, posConstraints):
+        self.negative = set()
+        self.vertexTimes = defaultdict(list)
+        for _, x, t in negConstraints:
+            if isinstance(x, frozenset):
+                self.negative.update((t, loc1, loc2) for loc1, loc2 in edge_moves(x))
+            else:
+                self.negative.add((t, x))
+                self.vertexTimes[x].append(t)
+
+        self.positive = defaultdict(list)
+        for agent1, agent2, x, t1, t2 in posConstraints:
+            t = t1 if agent1 == agent else t2
+            if isinstance(x, frozenset):
+                self.positive[t].append(edge_moves(x))
+            else:
+                self.positive[t].append({x})
+
+    def key(self):
+        # Hashable canonical form, equal for constraint sets the searches cannot tell apart
+        return (frozenset(self.negative),
+                frozenset((t, frozenset(frozenset(accepted) for accepted in acceptedSets))
+                          for t, acceptedSets in self.positive.items()))
+
+    def is_forbidden(self, t, loc, loc_after_move):
+        # Whether moving from loc to loc_after_move, arriving at time t, violates a negative constraint
+        return (t, loc_after_move) in self.negative or (t, loc, loc_after_move) in self.negative
+
+    def is_allowed_by_positive(self, t, loc, loc_after_move):
+        # Whether the move is the one required by every positive constraint at time t
+        return all(loc_after_move in accepted or (loc, loc_after_move) in accepted
+                   for accepted in self.positive.get(t, ()))
+
+    def safe_intervals(self, loc):
+        # Safe intervals [start, end] of loc, free of its negative vertex constraints and of the positive constraints it
+        # cannot satisfy. The times of the others are intervals of their own
+        intervals = []
+        start = 0
+        for t in sorted(set(self.vertexTimes.get(loc, ())) | self.positive.keys()):
+            # Nothing constrains the initial position at time 0
+            if t == 0:
+                continue
+            safe = (t, loc) not in self.negative and all(
+                loc in accepted or any(move[1] == loc for move in accepted if isinstance(move, tuple))
+                for accepted in self.positive.get(t, ()))
+
+            if start < t:
+                intervals.append((start, t - 1))
+            if safe:
+                intervals.append((t, t))
+            start = t + 1
+
+        intervals.append((start, SAFE_FOREVER))
+        return intervals
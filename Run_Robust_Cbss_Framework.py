@@ -12,27 +12,45 @@ from kBestSequencingWithGLKH import kBestSequencingWithGLKH
 
 class Robust_Cbss_framework:
 
-    def __init__(self, Positions, GoalLocations, no_collision_prob, delaysProb, MapAndDims, verifyAlpha, algorithm, configStr):
+    def __init__(self, Positions, GoalLocations, no_collision_prob, delaysProb, MapAndDims, verifyAlpha, algorithm, configStr,
+                 sequentialTest="normal", verifyBlockSize=1, verifyBlockGrowth=1.0, workers=1, lowLevelMode="astar",
+                 repairWindow=None, conflictAvoidance=False, plannerWorkers=1, solverWorkers=None,
+                 lazyKBest=False, solutionCacheDir=None):
         self.Positions = Positions  # Initial positions of agents
         self.GoalLocations = GoalLocations  # Locations of goals
 
         self.algorithm = algorithm
         self.ResolvedConflicts = 0
+        self.Counter_HighLevel_Expansions = 0  # CBS nodes taken from the open list and processed
+        self.Counter_Verify_Calls = 0
 
         self.OPEN = PriorityQueue()  # Open list for CBS nodes, prioritized by cost
         self.Num_roots_generated = 0  # Counter for the number of root nodes generated
         self.K_optimal_sequences = {}  # Dictionary to store k-optimal sequences of allocations
+        self.RootPaths = {}  # Unconstrained paths of the roots, keyed by (agent, sequence)
 
         if algorithm in ["RCbssEff", "IDP", "IRC"]:
-            self.K_Best_Seq_Solver = kBestSequencingWithGLKH(self.Positions, self.GoalLocations, MapAndDims, configStr)
+            self.K_Best_Seq_Solver = kBestSequencingWithGLKH(self.Positions, self.GoalLocations, MapAndDims, configStr,
+                                                             solverWorkers, lazyKBest, solutionCacheDir)
         else:
-            self.K_Best_Seq_Solver = kBestSequencing(self.Positions, self.GoalLocations, MapAndDims, configStr)
-
-        self.LowLevelPlanner = LowLevelPlan(MapAndDims, self.Positions, self.K_Best_Seq_Solver.cost_without_rotations, algorithm)
-        self.verify_algorithm = Verify(delaysProb, no_collision_prob, verifyAlpha, algorithm)
+            self.K_Best_Seq_Solver = kBestSequencing(self.Positions, self.GoalLocations, MapAndDims, configStr,
+                                                     solverWorkers, lazyKBest, solutionCacheDir)
+
+        self.LowLevelPlanner = LowLevelPlan(MapAndDims, self.Positions, self.K_Best_Seq_Solver.cost_without_rotations, algorithm,
+                                            lowLevelMode, repairWindow, conflictAvoidance=conflictAvoidance,
+                                            plannerWorkers=plannerWorkers)
+        self.verify_algorithm = Verify(delaysProb, no_collision_prob, verifyAlpha, algorithm, sequentialTest,
+                                       verifyBlockSize, verifyBlockGrowth, workers=workers)
         self.findConflict_algorithm = FindConflict(algorithm)
 
-        self.Solution = self.run()
+        # The verification and root planning worker processes (workers, plannerWorkers > 1) and the solver files live
+        # as long as the search
+        try:
+            self.Solution = self.run()
+        finally:
+            self.verify_algorithm.close()
+            self.LowLevelPlanner.close()
+            self.K_Best_Seq_Solver.close()
 
     ####################################################### run ############################################################
 
@@ -47,7 +65,7 @@ class Robust_Cbss_framework:
         # Assign the best sequence of task allocations for all agents to the root node
         Root.sequence = self.K_optimal_sequences[1]
         # Generate paths and calculate the cost for the root node
-        self.LowLevelPlanner.runLowLevelPlan(Root, list(range(len(self.Positions))))
+        self.PlanRoot(Root)
 
         # Add the root node to the open list
         self.OPEN.put((Root.g, Root))
@@ -61,11 +79,14 @@ class Robust_Cbss_framework:
             N = self.CheckNewRoot(N)
             if N is None:
                 continue
+            self.Counter_HighLevel_Expansions += 1
 
             # If the paths in the current node are verified as valid, avoiding collisions with probability P, return them as the solution
-            if (not N.isPositiveNode) and self.verify_algorithm.verify(N.paths):
-                return [N.paths, self.K_Best_Seq_Solver.Counter_Solver_TSP_For_Test,
-                        self.LowLevelPlanner.Counter_LowLevel_For_Test, self.Num_roots_generated, self.ResolvedConflicts, N.g]
+            if not N.isPositiveNode:
+                self.Counter_Verify_Calls += 1
+                if self.verify_algorithm.verify(N.paths):
+                    return [N.paths, self.K_Best_Seq_Solver.Counter_Solver_TSP_For_Test,
+                            self.LowLevelPlanner.Counter_LowLevel_For_Test, self.Num_roots_generated, self.ResolvedConflicts, N.g]
 
             # Identify the first conflict in the paths
             conflict = self.findConflict_algorithm.findConflict(N)
@@ -111,12 +132,28 @@ class Robust_Cbss_framework:
         newRoot = Node()
         newRoot.sequence = self.K_optimal_sequences[self.Num_roots_generated]
         # Calculate paths and cost for the new root
-        self.LowLevelPlanner.runLowLevelPlan(newRoot, list(range(len(self.Positions))))
+        self.PlanRoot(newRoot)
 
         self.OPEN.put((newRoot.g, newRoot))
         self.OPEN.put((N.g, N))
         return None
 
+    def PlanRoot(self, Root):
+        # Agents whose sequence already appeared in a root keep that root's path, only the others are replanned
+        agentsToPlan = []
+        for agent in range(len(self.Positions)):
+            path = self.RootPaths.get((agent, tuple(Root.sequence["Allocations"][agent])))
+            if path is None:
+                agentsToPlan.append(agent)
+            else:
+                Root.paths[agent] = path[:]
+                Root.g += len(path) - 1
+
+        if agentsToPlan and not self.LowLevelPlanner.runRootPlan(Root, agentsToPlan):
+            return
+        for agent in agentsToPlan:
+            self.RootPaths[(agent, tuple(Root.sequence["Allocations"][agent]))] = Root.paths[agent][:]
+
     ####################################################### Get conflict ############################################################
 
     def GenChild(self, N, NewCons):
@@ -127,16 +164,23 @@ class Robust_Cbss_framework:
         A.sequence = N.sequence
         A.g = N.g
 
+        # Inherit the parent's conflict tables, only the changes made below are recomputed
+        if N.pairConflicts is not None:
+            A.locTimes, A.edgeTimes, A.pairConflicts = dict(N.locTimes), dict(N.edgeTimes), dict(N.pairConflicts)
+            A.dirtyAgents, A.dirtyPairs = set(N.dirtyAgents), set(N.dirtyPairs)
+
         if len(NewCons) == 3:
             agent, _, _ = NewCons
             A.negConstraints[agent].add(NewCons)
-            if not self.LowLevelPlanner.runLowLevelPlan(A, [agent]):
+            if not self.LowLevelPlanner.runLowLevelRepair(A, NewCons):
                 return None
+            A.dirtyAgents.add(agent)
 
         else:
             A.isPositiveNode = True
             agent1, agent2, _, _, _ = NewCons
             A.posConstraints[agent1].add(NewCons)
             A.posConstraints[agent2].add(NewCons)
+            A.dirtyPairs.add((agent1, agent2))
 
         return A
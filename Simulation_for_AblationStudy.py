@@ -1,13 +1,15 @@
 class Simulation_for_type2_test:
 
-    def __init__(self, plan, algorithm, delaysProb, Positions, GoalLocations, callToPlannerCounter, randGen):
+    def __init__(self, plan, algorithm, delaysProb, Positions, GoalLocations, callToPlannerCounter, delaySamples):
         self.plan = plan
         self.algorithm = algorithm
         self.delaysProb = delaysProb
         self.positions = Positions
         self.remainGoals = GoalLocations
         self.callToPlanner = callToPlannerCounter
-        self.randGen = randGen
+        # Delay samples of this execution are those of simulation callToPlanner, read tick by tick
+        self.delaySamples = delaySamples
+        self.tick = 0
         self.SOC = 0
 
     def runSimulation(self):
@@ -35,7 +37,7 @@ class Simulation_for_type2_test:
                 lastLoc = path[0][0]
 
                 # Simulate agent movement with a delay probability
-                if len(path) != 1 and self.randGen.random() > self.delaysProb[agent]:
+                if len(path) != 1 and self.delaySamples.agent_moves(agent, self.callToPlanner, self.tick):
                     # Remove the first step if the agent moves
                     path.pop(0)
 
@@ -60,6 +62,7 @@ class Simulation_for_type2_test:
                 return False
 
             self.SOC += len(active_agents)
+            self.tick += 1
             # Remove agents that have completed their paths
             active_agents -= finish_agents
 
@@ -87,7 +90,7 @@ class Simulation_for_type2_test:
                 lastPos = new_pos[agent]
 
                 # Simulate agent movement with a delay probability
-                if len(path) != 1 and self.randGen.random() > self.delaysProb[agent]:
+                if len(path) != 1 and self.delaySamples.agent_moves(agent, self.callToPlanner, self.tick):
                     canMoveToNextLoc, direct = self.find_next_rotation_and_if_can_move_to_next_loc(lastPos, path[1][0])
                     if canMoveToNextLoc:
                         path.pop(0)
@@ -115,6 +118,7 @@ class Simulation_for_type2_test:
                 return False
 
             self.SOC += len(active_agents)
+            self.tick += 1
             # Remove agents that have completed their paths
             active_agents -= finish_agents
 
@@ -0,0 +1,186 @@
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+
+# RAM-backed directory preferred for the solver files
+SHARED_MEMORY_DIR = "/dev/shm"
+
+
+def scratch_parent():
+    # Where to create the scratch directories: /dev/shm if writable, else the default temporary directory
+    if os.path.isdir(SHARED_MEMORY_DIR) and os.access(SHARED_MEMORY_DIR, os.W_OK):
+        return SHARED_MEMORY_DIR
+    return None
+
+
+def remove_stale_directories(parent, name):
+    # Remove the scratch directories of name left by processes that no longer exist, such as runs stopped by
+    # SIGTERM, which skips both close() and the finalizer. Their names are "<name>_<pid>_" and the 8 characters
+    # added by mkdtemp
+    parent = parent or tempfile.gettempdir()
+    pattern = re.compile(rf"{re.escape(name)}_(\d+)_.{{8}}")
+    for entry in os.listdir(parent):
+        match = pattern.fullmatch(entry)
+        if match is None:
+            continue
+        try:
+            os.kill(int(match.group(1)), 0)
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+        except PermissionError:
+            # The process exists, under another user
+            pass
+
+
+def read_tour(fileTour):
+    # Read an LKH/GLKH tour file line by line: the length from its "COMMENT : Length = ..." line, and the nodes
+    # (numbered from 1) listed after TOUR_SECTION up to -1
+    cost, tour = None, []
+    lines = iter(fileTour)
+    for line in lines:
+        if line.startswith("TOUR_SECTION"):
+            break
+        if cost is None and "Length" in line:
+            cost = int(line.split("=")[1])
+
+    for line in lines:
+        node = int(line)
+        if node == -1:
+            break
+        tour.append(node)
+
+    return cost, tour
+
+
+# Tours of solved problems, on disk and shared by every run using the directory, keyed by the hash of the solver, its
+# parameters and the problem lines. Tours are moved into place with os.replace, so runs only ever read complete ones.
+# Past maxEntries plus a tenth, the least recently used are removed down to maxEntries minus a tenth
+class SolutionCache:
+    def __init__(self, directory, maxEntries=100000):
+        self.directory = directory
+        self.highWater = maxEntries + maxEntries // 10
+        self.lowWater = maxEntries - maxEntries // 10
+        os.makedirs(directory, exist_ok=True)
+        # Tours in the directory, as of the last scan plus those stored since
+        self.entries = len(self.scan())
+        self.lock = threading.Lock()
+
+    def key(self, *parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def load(self, key):
+        # The cost and tour stored under key, or None if it is not cached
+        path = os.path.join(self.directory, f"{key}.tour")
+        try:
+            with open(path, mode="r") as fileTour:
+                cost, tour = read_tour(fileTour)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return cost, tour
+
+    def store(self, key, tourFile):
+        fd, tmpPath = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        os.close(fd)
+        shutil.copyfile(tourFile, tmpPath)
+        os.replace(tmpPath, os.path.join(self.directory, f"{key}.tour"))
+        with self.lock:
+            self.entries += 1
+            if self.entries > self.highWater:
+                self.evict()
+
+    def scan(self):
+        with os.scandir(self.directory) as entries:
+            return [entry for entry in entries if entry.name.endswith(".tour")]
+
+    def evict(self):
+        def modified(entry):
+            try:
+                return entry.stat().st_mtime
+            except FileNotFoundError:
+                return 0
+
+        tours = sorted(self.scan(), key=modified)
+        for entry in tours[:max(0, len(tours) - self.lowWater)]:
+            # Another run may have removed it already
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self.entries = min(len(tours), self.lowWater)
+
+
+# Runs a solver of the LKH family on problems given as lines, with its files in a scratch directory of its own (under
+# /dev/shm when available). Calls with different tags use different files, so threads can solve at the same time.
+# With a solutionCacheDir, problems already solved are answered from a SolutionCache
+class SolverIO:
+    def __init__(self, solverPath, name, problemSuffix, runs=10, solutionCacheDir=None):
+        self.solverPath = solverPath
+        self.name = name
+        self.problemSuffix = problemSuffix
+        self.runs = runs
+        parent = scratch_parent()
+        remove_stale_directories(parent, name)
+        self.directory = tempfile.mkdtemp(prefix=f"{name}_{os.getpid()}_", dir=parent)
+        self.finalizer = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+
+        # (parameter, problem, tour) files of every tag, the parameter file written on first use
+        self.files = {}
+        # (write, solve, parse) seconds of every call
+        self.Timings = []
+
+        self.solutionCache = SolutionCache(solutionCacheDir) if solutionCacheDir is not None else None
+        self.Counter_Solver_Cache_Hits = 0
+        self.cacheLock = threading.Lock()
+
+    def tag_files(self, tag):
+        if tag not in self.files:
+            parFile, problemFile, tourFile = (os.path.join(self.directory, f"{self.name}{tag}{suffix}")
+                                              for suffix in (".par", self.problemSuffix, ".tour"))
+            with open(parFile, mode="w") as filePar:
+                filePar.writelines([f"PROBLEM_FILE = {problemFile}\n", f"RUNS = {self.runs}\n",
+                                    f"OUTPUT_TOUR_FILE = {tourFile}\n"])
+            self.files[tag] = (parFile, problemFile, tourFile)
+        return self.files[tag]
+
+    def solve(self, problemLines, tag=""):
+        # Returns the tour length and the tour found by the solver
+        if self.solutionCache is not None:
+            key = self.solutionCache.key(os.path.basename(self.solverPath), f"RUNS = {self.runs}", *problemLines)
+            cached = self.solutionCache.load(key)
+            if cached is not None:
+                with self.cacheLock:
+                    self.Counter_Solver_Cache_Hits += 1
+                return cached
+
+        parFile, problemFile, tourFile = self.tag_files(tag)
+        start = time.perf_counter()
+        with open(problemFile, mode="w") as fileProblem:
+            fileProblem.writelines(problemLines)
+        # A tour left by a previous call must not be mistaken for the result of this one
+        if os.path.exists(tourFile):
+            os.remove(tourFile)
+        written = time.perf_counter()
+
+        subprocess.run([self.solverPath, parFile], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        solved = time.perf_counter()
+
+        with open(tourFile, mode="r") as fileTour:
+            cost, tour = read_tour(fileTour)
+        if self.solutionCache is not None:
+            self.solutionCache.store(key, tourFile)
+        self.Timings.append((written - start, solved - written, time.perf_counter() - solved))
+        return cost, tour
+
+    def close(self):
+        self.finalizer()
@@ -1,11 +1,11 @@
 import os
-import random
 import time
 import csv
 import ast
 import sys
 
 from multiprocessing import Process, Queue
+from DelaySampleProvider import DelaySampleProvider
 from Run_Robust_Cbss_Framework import Robust_Cbss_framework
 from Simulation_for_AblationStudy import Simulation_for_type2_test
 
@@ -76,7 +76,7 @@ def read_locs_from_file(num_of_instance):
 
 ####################################################### run Test  #################################################################################
 def run_Test(queue, Positions, GoalLocations, DelaysProbDict, CurrAlgorithm):
-    randGen = random.Random(44)
+    delaySamples = DelaySampleProvider(DelaysProbDict, 44)
     OfflineTime, OnlineTime, callToPlanner, SOC = 0, 0, 0, 0
     while True:
         callToPlanner += 1
@@ -87,7 +87,7 @@ def run_Test(queue, Positions, GoalLocations, DelaysProbDict, CurrAlgorithm):
 
         online_start_time = time.time()
         s = Simulation_for_type2_test(p.Solution[0], CurrAlgorithm, DelaysProbDict, Positions, GoalLocations,
-                                      callToPlanner, randGen)
+                                      callToPlanner, delaySamples)
         OnlineTime += (time.time() - online_start_time)
 
         if s.runSimulation():
@@ -1,59 +1,307 @@
+import hashlib
 import math
-import random
-from itertools import combinations
+import multiprocessing
+from collections import OrderedDict, defaultdict
 
+import numpy as np
 from scipy.stats import norm
 
+from DelaySampleProvider import DelaySampleProvider
+from FindConflict import create_loc_times, create_edge_times, first_conflict_without_delays
+
+# Number of simulations advanced together, and number of ticks of delays drawn at once
+SIMULATION_BATCH = 1024
+TICKS_PER_DRAW = 64
+# Smallest simulation run that is split across the worker processes, smaller runs stay serial
+PARALLEL_MIN_SIMULATIONS = 256
+# Largest number of location-sharing pairs in a component for which exact pair probabilities are computed
+MAX_EXACT_PAIRS = 16
+# Width under which a component's bounds are taken as its exact success probability
+EXACT_TOLERANCE = 1e-9
+
 
 def verify_without_delays(paths):
-    for agent1, agent2 in combinations(paths.keys(), 2):
-        path1 = paths[agent1]
-        path2 = paths[agent2]
-
-        # Create loc-time dictionaries
-        locTimes1 = set()
-        for i, (loc, _) in enumerate(path1):
-            locTimes1.add((i, loc))
-
-        locTimes2 = set()
-        for i, (loc, _) in enumerate(path2):
-            locTimes2.add((i, loc))
-
-        # Detect location conflicts
-        common_locs = locTimes1 & locTimes2
-        if len(common_locs) != 0:
-            return False
+    return first_conflict_without_delays(paths) is None
 
-        # Create edge-time dictionaries
-        edgeTimes1 = set()
-        for i in range(len(path1) - 1):
-            if path1[i][0] != path1[i + 1][0]:
-                edge = (path1[i][0], path1[i + 1][0])
-                edgeTimes1.add((i + 1, edge))
-
-        edgeTimes2 = set()
-        for i in range(len(path2) - 1):
-            if path2[i][0] != path2[i + 1][0]:
-                edge = (path2[i][0], path2[i + 1][0])
-                edgeTimes2.add((i + 1, edge))
-
-        # Detect edge conflicts, including reversed edges
-        for time1, edge1 in edgeTimes1:
-            reversed_edge1 = (edge1[1], edge1[0])
-            if (time1, reversed_edge1) in edgeTimes2:
-                return False
 
-    return True
+def path_digest(path):
+    # Content hash of a path's locations, which identifies it in the verification caches
+    return hashlib.blake2b(np.array([loc for loc, _ in path], dtype=np.int64).tobytes(), digest_size=16).digest()
+
+
+def create_path_arrays(paths, agents):
+    # Stack the paths' locations into one array, padded with each agent's final location
+    lastSteps = np.array([len(paths[agent]) - 1 for agent in agents])
+    locsArray = np.empty((len(agents), lastSteps.max() + 1), dtype=np.int64)
+
+    for row, agent in enumerate(agents):
+        locs = [loc for loc, _ in paths[agent]]
+        locsArray[row, :len(locs)] = locs
+        locsArray[row, len(locs):] = locs[-1]
+
+    maxLoc = int(locsArray.max()) + 1
+    rows = np.arange(len(agents))[:, None]
+
+    # Mark the locations visited by more than one agent
+    agentLocs = np.unique(rows * maxLoc + locsArray)
+    locAgents = np.bincount(agentLocs % maxLoc, minlength=maxLoc)
+    sharedLocs = locAgents[locsArray] > 1
+
+    # Mark the moves whose reversed edge is traversed by another agent
+    fromLocs, toLocs = locsArray[:, :-1], locsArray[:, 1:]
+    edgeKeys, reversedKeys = fromLocs * maxLoc + toLocs, toLocs * maxLoc + fromLocs
+    agentEdges = np.unique((rows * maxLoc * maxLoc + edgeKeys)[fromLocs != toLocs])
+    edges, edgeAgents = np.unique(agentEdges % (maxLoc * maxLoc), return_counts=True)
+
+    sharedEdges = np.zeros(locsArray.shape, dtype=bool)
+    if edges.size:
+        reversedIndex = np.minimum(np.searchsorted(edges, reversedKeys), edges.size - 1)
+        reversedAgents = np.where(edges[reversedIndex] == reversedKeys, edgeAgents[reversedIndex], 0)
+        ownReversed = np.isin(rows * maxLoc * maxLoc + reversedKeys, agentEdges)
+        sharedEdges[:, 1:] = (fromLocs != toLocs) & (reversedAgents > ownReversed)
+
+    return locsArray, lastSteps, sharedLocs, sharedEdges
+
+
+def simulate_batch(pathArrays, draw_moves, numSims):
+    # Simulate numSims executions of the padded paths at once, returning a collision flag per simulation. draw_moves
+    # (firstTick, numTicks) gives the (numSims, numTicks, agents) moves, finished agents stay on their last location
+    locsArray, lastSteps, sharedLocs, sharedEdges = pathArrays
+    agentRows = np.arange(len(lastSteps))
+    maxLoc = int(locsArray.max()) + 1
+    collision = np.zeros(numSims, dtype=bool)
+
+    # Paths that share no location and no reversed edge can never collide
+    if not sharedLocs.any() and not sharedEdges.any():
+        return collision
+
+    # Per-simulation progress pointers into the agents' paths
+    progress = np.zeros((numSims, len(lastSteps)), dtype=np.int64)
+    running = np.flatnonzero((progress < lastSteps).any(axis=1))
+
+    moves = draw_moves(0, TICKS_PER_DRAW)
+    firstTick, tick = 0, 0
+    while running.size:
+        if tick == moves.shape[1]:
+            firstTick += tick
+            moves = draw_moves(firstTick, TICKS_PER_DRAW)
+            tick = 0
+
+        # Advance every agent that has not finished and is not delayed
+        runningProgress = progress[running]
+        step = moves[running, tick] & (runningProgress < lastSteps)
+        runningProgress += step
+        progress[running] = runningProgress
+        collided = np.zeros(running.size, dtype=bool)
+
+        # Vertex collisions: two agents of the same simulation at the same location
+        simRows, agentCols = np.nonzero(sharedLocs[agentRows, runningProgress])
+        if simRows.size > 1:
+            keys = simRows * maxLoc + locsArray[agentCols, runningProgress[simRows, agentCols]]
+            keys.sort()
+            collided[keys[1:][keys[1:] == keys[:-1]] // maxLoc] = True
+
+        # Swap collisions: two agents of the same simulation traversing the same edge in opposite directions
+        simRows, agentCols = np.nonzero(step & sharedEdges[agentRows, runningProgress])
+        if simRows.size > 1:
+            offsets = simRows * (maxLoc * maxLoc)
+            steps = runningProgress[simRows, agentCols]
+            fromLocs, toLocs = locsArray[agentCols, steps - 1], locsArray[agentCols, steps]
+            swapped = np.isin(offsets + toLocs * maxLoc + fromLocs, offsets + fromLocs * maxLoc + toLocs)
+            collided[simRows[swapped]] = True
+
+        collision[running[collided]] = True
+        stillActive = (runningProgress < lastSteps).any(axis=1)
+        running = running[~collided & stillActive]
+        tick += 1
+
+    return collision
+
+
+def count_successes(delaySamples, agents, pathArrays, firstSim, numSims):
+    # Number of collision-free runs among simulations firstSim .. firstSim + numSims - 1, simulated in batches
+    count_success = 0
+    for first in range(firstSim, firstSim + numSims, SIMULATION_BATCH):
+        batchSims = min(SIMULATION_BATCH, firstSim + numSims - first)
+
+        def draw_moves(firstTick, numTicks):
+            return delaySamples.moves(agents, first, batchSims, firstTick, numTicks)
+
+        collision = simulate_batch(pathArrays, draw_moves, batchSims)
+        count_success += batchSims - int(collision.sum())
+
+    return count_success
+
+
+# Delay samples of a worker process, reading the same streams as the parent
+workerDelaySamples = None
+
+
+def init_worker(delaysProb, seed):
+    global workerDelaySamples
+    workerDelaySamples = DelaySampleProvider(delaysProb, seed)
+
+
+def worker_count_successes(agents, pathArrays, firstSim, numSims):
+    return count_successes(workerDelaySamples, agents, pathArrays, firstSim, numSims)
+
+
+def pair_collision_bounds(path1, path2, delayProb1, delayProb2, tolerance=1e-12, stopAbove=1.0):
+    # Bounds on the probability that two agents collide, by DP over their joint progress, tick after tick, up to the
+    # last shared location. Stops early once the probability exceeds stopAbove
+    locTimes1, locTimes2 = create_loc_times(path1), create_loc_times(path2)
+    sharedLocs = locTimes1.keys() & locTimes2.keys()
+    if not sharedLocs:
+        return 0.0, 0.0
+
+    # Cut every path after its last shared location and append an exit step, where the agent is out of reach
+    cutLocs, moveProbs = [], []
+    for path, delayProb in ((path1, delayProb1), (path2, delayProb2)):
+        locs = [loc for loc, _ in path]
+        lastShared = max(i for i, loc in enumerate(locs) if loc in sharedLocs)
+        locs = locs[:lastShared + 1] + ([-1] if lastShared < len(locs) - 1 else [])
+        moves = np.full(len(locs), 1 - delayProb)
+        moves[-1] = 0
+        cutLocs.append(np.array(locs))
+        moveProbs.append(moves)
+
+    locs1, locs2 = cutLocs
+    move1, move2 = moveProbs
+    vertex = (locs1[:, None] == locs2[None, :]) & (locs1[:, None] != -1)
+
+    # A swap needs both agents to move, the first from locs1[i] to locs2[j] while the second does the opposite
+    swap = np.zeros(vertex.shape, dtype=bool)
+    edgeTimes1, edgeTimes2 = create_edge_times(path1), create_edge_times(path2)
+    if any((edge[1], edge[0]) in edgeTimes2 for edge in edgeTimes1):
+        swap[:-1, :-1] = ((locs1[1:, None] == locs2[None, :-1]) & (locs1[:-1, None] == locs2[None, 1:]) &
+                          (locs1[:-1] != locs1[1:])[:, None])
+
+    # The agents are out of each other's reach once one of them exits, or both stand at their final locations
+    done = np.zeros(vertex.shape, dtype=bool)
+    done[-1, -1] = True
+    if locs1[-1] == -1:
+        done[-1, :] = True
+    if locs2[-1] == -1:
+        done[:, -1] = True
+
+    # Only the window [i0, i1] x [j0, j1] of the joint distribution holding mass is stored
+    dist = np.ones((1, 1))
+    i0 = j0 = 0
+    collided = pruned = 0.0
+    while True:
+        i1, j1 = i0 + dist.shape[0] - 1, j0 + dist.shape[1] - 1
+        ni1, nj1 = min(i1 + 1, len(locs1) - 1), min(j1 + 1, len(locs2) - 1)
+        rows, cols = ni1 - i0 + 1, nj1 - j0 + 1
+        m1, m2 = move1[i0:i1 + 1, None], move2[None, j0:j1 + 1]
+
+        new = np.zeros((rows, cols))
+        new[:dist.shape[0], :dist.shape[1]] += dist * (1 - m1) * (1 - m2)
+        new[1:, :dist.shape[1]] += (dist * m1 * (1 - m2))[:rows - 1]
+        new[:dist.shape[0], 1:] += (dist * (1 - m1) * m2)[:, :cols - 1]
+
+        both = dist * m1 * m2
+        swapped = swap[i0:i1 + 1, j0:j1 + 1]
+        collided += both[swapped].sum()
+        both[swapped] = 0
+        new[1:, 1:] += both[:rows - 1, :cols - 1]
+
+        # Remove the mass of states with a vertex collision, and of states that can no longer collide
+        collisions = vertex[i0:ni1 + 1, j0:nj1 + 1]
+        collided += new[collisions].sum()
+        new[collisions | done[i0:ni1 + 1, j0:nj1 + 1]] = 0
+        if collided > stopAbove:
+            return float(collided), float(collided + pruned + new.sum())
+
+        # Shrink the window to the rows and columns still holding non-negligible mass
+        rowMass, colMass = new.sum(axis=1), new.sum(axis=0)
+        keepRows, keepCols = np.flatnonzero(rowMass > tolerance * 1e-3), np.flatnonzero(colMass > tolerance * 1e-3)
+        if keepRows.size == 0 or keepCols.size == 0:
+            return float(collided), float(collided + pruned + new.sum())
+
+        window = new[keepRows[0]:keepRows[-1] + 1, keepCols[0]:keepCols[-1] + 1]
+        pruned += new.sum() - window.sum()
+        dist, i0, j0 = window, i0 + keepRows[0], j0 + keepCols[0]
+
+        remaining = dist.sum()
+        if remaining < tolerance:
+            return float(collided), float(collided + pruned + remaining)
+
+
+def find_interaction_components(paths):
+    # Connected components of the interaction graph, where two agents interact if their paths share a location (a
+    # swap along an edge shares both of its locations too), as (agents, pairs sharing a location) per component of
+    # more than one agent. Sharing pairs are read from the product of the agents x visited locations matrix
+    agents = list(paths.keys())
+    rows = np.repeat(np.arange(len(agents)), [len(paths[agent]) for agent in agents])
+    _, cols = np.unique([loc for agent in agents for loc, _ in paths[agent]], return_inverse=True)
+    visits = np.zeros((len(agents), cols.max() + 1), dtype=np.float32)
+    visits[rows, cols] = 1
+    pairRows, pairCols = np.nonzero(np.triu(visits @ visits.T, k=1))
+
+    parent = list(range(len(agents)))
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    pairs = list(zip(pairRows.tolist(), pairCols.tolist()))
+    for row, col in pairs:
+        parent[find(col)] = find(row)
+
+    components = defaultdict(lambda: ([], []))
+    for row, agent in enumerate(agents):
+        components[find(row)][0].append(agent)
+    for row, col in pairs:
+        components[find(row)][1].append((agents[row], agents[col]))
+    return [component for component in components.values() if len(component[0]) > 1]
+
+
+def wilson_bounds(count_success, numSims, z):
+    # Wilson score interval of a binomial proportion, each side at the one-sided level matching z
+    P0 = count_success / numSims
+    denominator = 1 + z ** 2 / numSims
+    center = (P0 + z ** 2 / (2 * numSims)) / denominator
+    margin = z * math.sqrt(P0 * (1 - P0) / numSims + z ** 2 / (4 * numSims ** 2)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
 
 
 class Verify:
 
-    def __init__(self, delaysProb, no_collision_prob, verifyAlpha, algorithm):
+    def __init__(self, delaysProb, no_collision_prob, verifyAlpha, algorithm, sequentialTest="normal", blockSize=1,
+                 blockGrowth=1.0, sprtDelta=0.01, workers=1, cacheSize=4096):
         self.delaysProb = delaysProb
         self.no_collision_prob = no_collision_prob
         self.verifyAlpha = verifyAlpha
         self.algorithm = algorithm
-        self.randGen = random.Random(47)
+        # Common random numbers: simulation i of every component reads the same delay samples
+        self.delaySamples = DelaySampleProvider(delaysProb, 47)
+        # Worker processes sharing the simulations, started on first use when workers > 1
+        self.workers = workers
+        self.pool = None
+
+        # Stopping rule ("normal" or "sprt") and the block sizes used after the initial s0 simulations
+        self.sequentialTest = sequentialTest
+        self.blockSize = blockSize
+        self.blockGrowth = blockGrowth
+        self.sprtDelta = sprtDelta
+        self.z1SubAlpha = norm.ppf(1 - verifyAlpha)
+        self.zQuantiles = {verifyAlpha: self.z1SubAlpha}
+
+        self.Counter_Simulations_For_Test = 0
+        self.Simulations_Per_Verify = []
+
+        # LRU caches of results keyed by path digests, cacheSize entries each: decisions per node, exact bounds per
+        # pair, simulation counts per component
+        self.cacheSize = cacheSize
+        self.decisionCache = OrderedDict()
+        self.pairCache = OrderedDict()
+        self.componentStats = OrderedDict()
+        self.Counter_Verify_Cache_Hits = 0
+        self.Counter_Verify_Cache_Misses = 0
+        self.Counter_Component_Cache_Hits = 0
+        self.Counter_Component_Cache_Misses = 0
 
     def verify(self, paths):
         if self.algorithm in ["RCbssEff", "RCbssBase", "IRC"]:
@@ -61,86 +309,224 @@ class Verify:
         else:
             return verify_without_delays(paths)
 
-    def run_s_simulations(self, s0, paths):
-        count_success = 0
-
-        # Run s0 simulations
-        for sim in range(s0):
-            # Create a copy of the paths for independent simulation
-            paths_copy = {agent: list(path) for agent, path in paths.items()}
-            # Initialize the set of active agents (agents that have not finished their path)
-            active_agents = {agent for agent, path in paths_copy.items() if len(path) > 1}
-            # Flag to indicate if a collision occurs
-            collision = False
-
-            while active_agents:
-                # Set to track current agent locations
-                locsAndEdge = set()
-                # Set to track agents that have completed their paths
-                finish_agents = set()
-
-                for agent, path in paths_copy.items():
-                    # Current path of the agent
-                    lastLoc = path[0][0]
-
-                    # Simulate agent movement with a delay probability
-                    if len(path) != 1 and self.randGen.random() > self.delaysProb[agent]:
-                        # Remove the first step if the agent moves
-                        path.pop(0)
-
-                    # Current location of the agent
-                    loc = path[0][0]
-                    # Check for collision
-                    if loc in locsAndEdge or (loc, lastLoc) in locsAndEdge:
-                        collision = True
-                        break
-                    locsAndEdge.add(loc)
-                    locsAndEdge.add((lastLoc, loc))
-
-                    # If the agent has reached its destination, mark it for removal
-                    if len(path) == 1:
-                        finish_agents.add(agent)
-
-                # Stop the simulation if a collision occurs
-                if collision:
-                    break
-
-                # Remove agents that have completed their paths
-                active_agents -= finish_agents
-
-            # Increment success count if no collision occurred
-            if not collision:
-                count_success += 1
+    def run_s_simulations(self, s0, paths, firstSim=0):
+        agents = list(paths.keys())
+        pathArrays = create_path_arrays(paths, agents)
+        self.Counter_Simulations_For_Test += s0
+
+        # Simulations are identified by their index, so splitting them into contiguous ranges, one per worker,
+        # gives the same number of successful simulations as the serial run
+        if self.workers > 1 and s0 >= PARALLEL_MIN_SIMULATIONS:
+            bounds = [firstSim + s0 * i // self.workers for i in range(self.workers + 1)]
+            tasks = [(agents, pathArrays, first, last - first) for first, last in zip(bounds, bounds[1:])]
+            return sum(self.get_pool().starmap(worker_count_successes, tasks))
 
         # Return the number of successful simulations
-        return count_success
+        return count_successes(self.delaySamples, agents, pathArrays, firstSim, s0)
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                             initargs=(self.delaysProb, self.delaySamples.seed))
+        return self.pool
+
+    def close(self):
+        # Stop the worker processes, if any were started
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
 
     def verify_monte_carlo(self, paths):
+        # Identical path sets get the decision they already received
+        pathsKey = {agent: path_digest(path) for agent, path in paths.items()}
+        nodeKey = frozenset(pathsKey.items())
+        decision = self.cached(self.decisionCache, nodeKey)
+        if decision is not None:
+            self.Counter_Verify_Cache_Hits += 1
+            self.Simulations_Per_Verify.append(0)
+            return decision
+        self.Counter_Verify_Cache_Misses += 1
+
+        countBefore = self.Counter_Simulations_For_Test
+        decision = self.verify_components(paths, pathsKey)
+        self.Simulations_Per_Verify.append(self.Counter_Simulations_For_Test - countBefore)
+        return self.store(self.decisionCache, nodeKey, decision)
+
+    def cached(self, cache, key):
+        # The value of key in cache, now its most recently used entry, or None
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def store(self, cache, key, value):
+        # Add value to cache, evicting the least recently used entries beyond cacheSize
+        if self.cacheSize > 0:
+            cache[key] = value
+            while len(cache) > self.cacheSize:
+                cache.popitem(last=False)
+        return value
+
+    def verify_components(self, paths, pathsKey):
+        # Agents interacting with no other agent can never collide, so only larger components are considered
+        components = find_interaction_components(paths)
+        if not components:
+            return True
+
+        # Exact pairwise collision probabilities bound every component's success probability, and may reject the
+        # node or certify it without sampling
+        componentsPaths = [{agent: paths[agent] for agent in agents} for agents, _ in components]
+        componentsBounds = self.components_bounds(componentsPaths, [pairs for _, pairs in components], pathsKey)
+        if componentsBounds is None:
+            return False
+        if math.prod(lower for lower, _ in componentsBounds) >= self.no_collision_prob:
+            return True
+
+        # Components with tight bounds (pairs, in particular) are known exactly, the others are left to Monte Carlo
+        knownFactor = math.prod(lower for lower, upper in componentsBounds if upper - lower <= EXACT_TOLERANCE)
+        sampled = [(componentPaths, bounds) for componentPaths, bounds in zip(componentsPaths, componentsBounds)
+                   if bounds[1] - bounds[0] > EXACT_TOLERANCE]
+        # At knownFactor == no_collision_prob the sampled components would have to be collision-free with certainty,
+        # which no number of simulations shows (the target would be 1)
+        if not sampled or knownFactor <= self.no_collision_prob:
+            return False
+
+        target = self.no_collision_prob / knownFactor
+        # Components are identified by their agents' path contents, so unchanged components reuse their simulations
+        sampledKeys = [frozenset((agent, pathsKey[agent]) for agent in componentPaths) for componentPaths, _ in sampled]
+        if len(sampled) == 1:
+            return self.sequential_test(sampled[0][0], target, sampledKeys[0])
+        return self.combined_test([componentPaths for componentPaths, _ in sampled], target,
+                                  [bounds for _, bounds in sampled], sampledKeys)
+
+    def components_bounds(self, componentsPaths, componentsPairs, pathsKey):
+        # [lower, upper] bounds of every component's success probability: the union bound over its pairs from below,
+        # the most likely pair collision from above. Pairs are computed one at a time, returning None as soon as the
+        # upper bounds reject the node, and stopping once the lower bounds can no longer certify it. Components left
+        # unfinished, and all of them when one is crowded, keep 0 as lower bound and are decided by Monte Carlo
+        bounds = [[0.0, 1.0] for _ in componentsPaths]
+        if any(len(pairs) > MAX_EXACT_PAIRS for pairs in componentsPairs):
+            return bounds
+
+        collisionSums = [0.0] * len(componentsPaths)
+        for index, (paths, pairs) in enumerate(zip(componentsPaths, componentsPairs)):
+            for agent1, agent2 in pairs:
+                if math.prod(max(0.0, 1 - collisionSum) for collisionSum in collisionSums) < self.no_collision_prob:
+                    return bounds
+
+                collisionLower, collisionUpper = self.pair_bounds(paths, pathsKey, agent1, agent2)
+                bounds[index][1] = min(bounds[index][1], 1 - collisionLower)
+                if math.prod(upper for _, upper in bounds) < self.no_collision_prob:
+                    return None
+                collisionSums[index] += collisionUpper
+
+            bounds[index][0] = max(0.0, 1 - collisionSums[index])
+        return bounds
+
+    def pair_bounds(self, paths, pathsKey, agent1, agent2):
+        pairKey = (agent1, pathsKey[agent1], agent2, pathsKey[agent2])
+        bounds = self.cached(self.pairCache, pairKey)
+        if bounds is None:
+            # A pair more likely to collide than 1 - no_collision_prob rejects every node holding it, its bounds
+            # need not be tighter
+            bounds = self.store(self.pairCache, pairKey,
+                                pair_collision_bounds(paths[agent1], paths[agent2], self.delaysProb[agent1],
+                                                      self.delaysProb[agent2], stopAbove=1 - self.no_collision_prob))
+        return bounds
+
+    def initial_simulations(self, target):
         # Calculate initial simulations size (s0) based on the desired confidence level
-        z1SubAlphaSquare = (norm.ppf(1 - self.verifyAlpha)) ** 2
-        s0 = max(30, math.ceil(z1SubAlphaSquare * (self.no_collision_prob / (1 - self.no_collision_prob))))
+        return max(30, math.ceil(self.z1SubAlpha ** 2 * (target / (1 - target))))
+
+    def component_stats(self, componentKey, paths, numSims):
+        # Reuse the simulations already run on an identical component, topping them up to numSims
+        stats = self.cached(self.componentStats, componentKey)
+        if stats is None:
+            self.Counter_Component_Cache_Misses += 1
+            stats = self.store(self.componentStats, componentKey, [0, 0])
+        else:
+            self.Counter_Component_Cache_Hits += 1
+
+        if stats[1] < numSims:
+            self.add_simulations(stats, numSims - stats[1], paths)
+        return stats
+
+    def add_simulations(self, stats, blockSize, paths):
+        # The component's simulations are numbered in order, continuing from those already run
+        stats[0] += self.run_s_simulations(blockSize, paths, stats[1])
+        stats[1] += blockSize
 
-        # Initial simulation run
-        count_success = self.run_s_simulations(s0, paths)
-        # Additional simulations performed iteratively
+    def sequential_test(self, paths, target, componentKey):
+        # Initial simulation run (count_success, s0), possibly already done for this component
+        stats = self.component_stats(componentKey, paths, self.initial_simulations(target))
 
+        # Additional simulations performed block by block until the stopping rule decides
         while True:
-            # Calculate the estimated probability of no collision (P0)
-            P0 = count_success / s0
-            # Upper confidence bound (c1)
-            c1 = self.no_collision_prob + norm.ppf(1 - self.verifyAlpha) * math.sqrt(
-                (self.no_collision_prob * (1 - self.no_collision_prob)) / s0)
-            # Lower confidence bound (c2)
-            c2 = self.no_collision_prob - norm.ppf(1 - self.verifyAlpha) * math.sqrt(
-                (self.no_collision_prob * (1 - self.no_collision_prob)) / s0)
-
-            # If P0 is greater than or equal to the upper bound, the solution is likely p-robust
-            if P0 >= c1:
+            if self.sequentialTest == "sprt":
+                decision = self.sprt_decision(stats[0], stats[1], target)
+            else:
+                decision = self.normal_decision(stats[0], stats[1], target)
+
+            if decision is not None:
+                return decision
+
+            # If no decision, add the next block of simulations
+            self.add_simulations(stats, self.next_block_size(stats[1]), paths)
+
+    def combined_test(self, componentsPaths, target, componentsBounds, componentsKeys):
+        # Whether the product of the components' success probabilities reaches target, with one-sided Wilson
+        # intervals at level verifyAlpha / components, clipped to the exact componentsBounds
+        z = self.z_quantile(self.verifyAlpha / len(componentsPaths))
+        s0 = self.initial_simulations(target)
+        stats = [self.component_stats(componentKey, paths, s0)
+                 for componentKey, paths in zip(componentsKeys, componentsPaths)]
+
+        while True:
+            wilsonBounds = (wilson_bounds(count_success, numSims, z) for count_success, numSims in stats)
+            bounds = [(max(lower, exactLower), min(upper, exactUpper))
+                      for (lower, upper), (exactLower, exactUpper) in zip(wilsonBounds, componentsBounds)]
+
+            if math.prod(lower for lower, _ in bounds) >= target:
                 return True
-            # If P0 is less than the lower bound, the solution is not p-robust
-            if P0 < c2:
+            if math.prod(upper for _, upper in bounds) < target:
                 return False
 
-            # If no decision, add one more simulation
-            s0 += 1
-            count_success += self.run_s_simulations(1, paths)
+            # Add a block of simulations to the component with the widest relative interval
+            widest = max(range(len(bounds)), key=lambda i: 1 - bounds[i][0] / bounds[i][1])
+            self.add_simulations(stats[widest], self.next_block_size(stats[widest][1]), componentsPaths[widest])
+
+    def z_quantile(self, alpha):
+        if alpha not in self.zQuantiles:
+            self.zQuantiles[alpha] = norm.ppf(1 - alpha)
+        return self.zQuantiles[alpha]
+
+    def next_block_size(self, numSims):
+        # Blocks grow geometrically with the number of simulations run so far (one by one with the defaults)
+        return max(self.blockSize, math.ceil(numSims * (self.blockGrowth - 1)))
+
+    def normal_decision(self, count_success, numSims, target):
+        # Calculate the estimated probability of no collision (P0)
+        P0 = count_success / numSims
+        margin = self.z1SubAlpha * math.sqrt((target * (1 - target)) / numSims)
+
+        # If P0 is greater than or equal to the upper bound (c1), the solution is likely p-robust
+        if P0 >= target + margin:
+            return True
+        # If P0 is less than the lower bound (c2), the solution is not p-robust
+        if P0 < target - margin:
+            return False
+        return None
+
+    def sprt_decision(self, count_success, numSims, target):
+        # Wald's SPRT of p <= target - sprtDelta against p >= target + sprtDelta, valid when checked after every block
+        p0 = max(target - self.sprtDelta, 1e-12)
+        p1 = min(target + self.sprtDelta, 1 - 1e-12)
+        logLikelihoodRatio = (count_success * math.log(p1 / p0) +
+                              (numSims - count_success) * math.log((1 - p1) / (1 - p0)))
+
+        if logLikelihoodRatio >= -math.log(self.verifyAlpha):
+            return True
+        if logLikelihoodRatio <= math.log(self.verifyAlpha):
+            return False
+        return None
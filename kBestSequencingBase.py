@@ -0,0 +1,146 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import PriorityQueue
+
+from GridGraph import grid_graph
+
+# Cost of a node following itself in the assignment relaxation, high enough never to be chosen
+SELF_LOOP_COST = 10 ** 12
+
+
+###################################################### kBestSequencingBase class ##############################################################
+# Lawler partitioning over the allocation edges, shared by kBestSequencing (LKH) and kBestSequencingWithGLKH (GLKH).
+# Subclasses provide solve_tsp_with_constraints(includeE, excludeE, tag) and lower_bound(includeE, excludeE)
+class kBestSequencingBase:
+    def __init__(self, Positions, GoalLocations, dict_of_map_and_dim, configStr, solverWorkers=None, lazyKBest=False):
+        self.Positions = Positions
+        self.GoalLocations = GoalLocations
+        self.configStr = configStr
+
+        self.MapAndDims = dict_of_map_and_dim
+        self.graph = grid_graph(dict_of_map_and_dim)
+        self.OPEN = PriorityQueue()
+        self.Solutions = {}
+
+        # Subproblems solved by running the solver, and those answered by its solution cache instead
+        self.Counter_Solver_TSP_For_Test = 0
+        self.Counter_Solver_Cache_Hits = 0
+        # Solver subprocesses running at the same time on the subproblems of find_k_best_solution
+        self.solverWorkers = solverWorkers or os.cpu_count() or 1
+        self.executor = None
+        # Solve the subproblems only when their lower bound reaches the top of OPEN, whose entries are then
+        # (cost or bound, solved, insertion order, (includeE, excludeE[, solution]))
+        self.lazyKBest = lazyKBest
+        self.Counter_Subproblems = 0
+
+    ######################################################### Find K Best Solution ###############################################################
+
+    def find_k_best_solution(self, k):
+        # If k is 1, find and return the best (first) solution
+        if k == 1:
+            # Save the first allocation along with the include/exclude sets
+            self.Solutions[k] = (set(), set(), self.solve_all_with_constraints([(set(), set())])[0])
+            # Return optimal allocation
+            return self.Solutions[k][2]
+
+        # Retrieve the previous solution for k-1
+        includeE, excludeE, optimalSequences = self.Solutions[k - 1]
+
+        # Partition by the edges in the current solution's allocation
+        subproblems = []
+        for index, (v0, v1) in enumerate(optimalSequences["Alloc_edges"]):
+            # Create a new include set by adding edges up to the current index
+            newIncludeE = includeE | set(optimalSequences["Alloc_edges"][:index])
+            # Create a new exclude set by adding the current edge (only locs)
+            newExcludeE = excludeE | {(v0, v1)}
+
+            if newIncludeE.intersection(newExcludeE):
+                continue
+            subproblems.append((newIncludeE, newExcludeE))
+
+        if self.lazyKBest:
+            return self.find_next_solution_lazily(k, subproblems)
+
+        # Solve the TSP problems with the new constraints, then consider them in the order of the edges
+        solutions = self.solve_all_with_constraints(subproblems)
+        for (newIncludeE, newExcludeE), PotentialOptimalSequences in zip(subproblems, solutions):
+            if not self.respects_constraints(newIncludeE, newExcludeE, PotentialOptimalSequences):
+                continue
+
+            # Add the valid solution to the priority queue
+            self.OPEN.put((PotentialOptimalSequences["Cost"], (newIncludeE, newExcludeE, PotentialOptimalSequences)))
+
+        # If the priority queue is empty, return a default solution indicating no more allocations
+        if self.OPEN.empty():
+            return {"Allocations": {}, "Alloc_edges": [], "Cost": math.inf}
+
+        # Retrieve the next best solution from the queue
+        _, (includeE, excludeE, optimalSequences) = self.OPEN.get()
+        # Save the new solution in the list of solutions
+        self.Solutions[k] = (includeE, excludeE, optimalSequences)
+        # Return the optimal solution found
+        return optimalSequences
+
+    def find_next_solution_lazily(self, k, subproblems):
+        # Queue the subproblems by lower bound. Unsolved entries at the top are solved and queued again by cost, until
+        # a solved one comes first: its cost is then at most every remaining bound. Only unsolved entries tied with the
+        # top one are solved with it (up to solverWorkers), any other may never reach the top. At equal keys the
+        # unsolved entries come first, so the solutions keep the costs of the eager enumeration
+        for newIncludeE, newExcludeE in subproblems:
+            self.Counter_Subproblems += 1
+            self.OPEN.put((self.lower_bound(newIncludeE, newExcludeE), 0, self.Counter_Subproblems,
+                           (newIncludeE, newExcludeE)))
+
+        while not self.OPEN.empty():
+            key, solved, _, subproblem = self.OPEN.get()
+            if solved:
+                # Save the new solution in the list of solutions
+                self.Solutions[k] = subproblem
+                return subproblem[2]
+
+            batch = [subproblem]
+            while len(batch) < self.solverWorkers and not self.OPEN.empty() and self.OPEN.queue[0][:2] == (key, 0):
+                batch.append(self.OPEN.get()[3])
+
+            solutions = self.solve_all_with_constraints(batch)
+            for (newIncludeE, newExcludeE), PotentialOptimalSequences in zip(batch, solutions):
+                if self.respects_constraints(newIncludeE, newExcludeE, PotentialOptimalSequences):
+                    self.Counter_Subproblems += 1
+                    self.OPEN.put((PotentialOptimalSequences["Cost"], 1, self.Counter_Subproblems,
+                                   (newIncludeE, newExcludeE, PotentialOptimalSequences)))
+
+        return {"Allocations": {}, "Alloc_edges": [], "Cost": math.inf}
+
+    def respects_constraints(self, includeE, excludeE, optimalSequences):
+        # The solver only prices the constraints, the solution must still use every included edge and no excluded one
+        alloc_edges_set = set(optimalSequences["Alloc_edges"])
+        return includeE <= alloc_edges_set and not excludeE & alloc_edges_set
+
+    ######################################################### Solve tsp with constraints ###############################################################
+    def solve_all_with_constraints(self, subproblems):
+        # Solve (includeE, excludeE) subproblems, up to solverWorkers at a time, each thread of the pool with its own
+        # solver files. The results are returned in the order of the subproblems
+        hitsBefore = self.solverIO.Counter_Solver_Cache_Hits
+        if self.solverWorkers <= 1 or len(subproblems) <= 1:
+            solutions = [self.solve_tsp_with_constraints(includeE, excludeE) for includeE, excludeE in subproblems]
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.solverWorkers, thread_name_prefix="solver")
+            solutions = list(self.executor.map(
+                lambda subproblem: self.solve_tsp_with_constraints(*subproblem,
+                                                                   tag=f"_{threading.current_thread().name}"),
+                subproblems))
+
+        hits = self.solverIO.Counter_Solver_Cache_Hits - hitsBefore
+        self.Counter_Solver_Cache_Hits += hits
+        self.Counter_Solver_TSP_For_Test += len(subproblems) - hits
+        return solutions
+
+    def close(self):
+        # Stop the solver threads and remove the solver files of this run
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.solverIO.close()
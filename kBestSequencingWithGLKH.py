@@ -1,22 +1,11 @@
-import math
 import os
-import subprocess
 from collections import defaultdict
 import numpy as np
-from queue import PriorityQueue
+from scipy.optimize import linear_sum_assignment
 from collections import deque
 
-
-####################################################### generate egtsp Parameters file ############################################################
-def generate_EGTSP_parameters_file(configStr):
-    lines = [
-        f"PROBLEM_FILE = {os.getcwd()}/EGSTP_runtime_files/{configStr}_mEgtsp.gtsp\n",
-        f"RUNS = 10\n",
-        f"OUTPUT_TOUR_FILE = {os.getcwd()}/EGSTP_runtime_files/{configStr}_mEgtsp.tour\n"
-    ]
-
-    with open(f"{os.getcwd()}/EGSTP_runtime_files/{configStr}_mEgtsp.par", mode="w+") as filePar:
-        filePar.writelines(lines)
+from SolverIO import SolverIO
+from kBestSequencingBase import kBestSequencingBase, SELF_LOOP_COST
 
 
 ####################################################### Create 4 copies of specific goal ############################################################
@@ -25,103 +14,71 @@ def create_copy_of_goals(GoalLocations):
 
 
 ######################################################### kBestSequencingWithGLKH class ###############################################################
-class kBestSequencingWithGLKH:
-    def __init__(self, Positions, GoalLocations, dict_of_map_and_dim, configStr):
-        self.Positions = Positions
-        self.GoalLocations = GoalLocations
+class kBestSequencingWithGLKH(kBestSequencingBase):
+    def __init__(self, Positions, GoalLocations, dict_of_map_and_dim, configStr, solverWorkers=None,
+                 lazyKBest=False, solutionCacheDir=None):
+        super().__init__(Positions, GoalLocations, dict_of_map_and_dim, configStr, solverWorkers, lazyKBest)
         self.AllCopyOfGoals = create_copy_of_goals(GoalLocations)
         self.AllPosAndGoals = self.Positions + self.AllCopyOfGoals
-        self.configStr = configStr
-
-        self.MapAndDims = dict_of_map_and_dim
-        self.OPEN = PriorityQueue()
-        self.Solutions = {}
-
-        self.Counter_Solver_TSP_For_Test = 0
 
         self.cost_without_rotations, self.cost_with_rotations = self.precompute_costs()
-
-        generate_EGTSP_parameters_file(self.configStr)
-
-    ######################################################### Find K Best Solution ###############################################################
-
-    def find_k_best_solution(self, k):
-        # If k is 1, find and return the best (first) solution
-        if k == 1:
-            # Save the first allocation along with the include/exclude sets
-            self.Solutions[k] = (set(), set(), self.solve_tsp_with_constraints(set(), set()))
-            # Return optimal allocation
-            return self.Solutions[k][2]
-
-        # Retrieve the previous solution for k-1
-        includeE, excludeE, optimalSequences = self.Solutions[k - 1]
-
-        # Iterate over the edges in the current solution's allocation
-        for index, (v0, v1) in enumerate(optimalSequences["Alloc_edges"]):
-            # Create a new include set by adding edges up to the current index
-            newIncludeE = includeE | set(optimalSequences["Alloc_edges"][:index])
-            # Create a new exclude set by adding the current edge (only locs)
-            newExcludeE = excludeE | {(v0, v1)}
-
-            if newIncludeE.intersection(newExcludeE):
-                continue
-
-            # Solve the TSP problem with the new constraints
-            PotentialOptimalSequences = self.solve_tsp_with_constraints(newIncludeE, newExcludeE)
-
-            alloc_edges_set = set(PotentialOptimalSequences["Alloc_edges"])
-
-            if not newIncludeE <= alloc_edges_set:
-                continue
-
-            if newExcludeE & alloc_edges_set:
-                continue
-
-            # Add the valid solution to the priority queue
-            self.OPEN.put((PotentialOptimalSequences["Cost"], (newIncludeE, newExcludeE, PotentialOptimalSequences)))
-
-        # If the priority queue is empty, return a default solution indicating no more allocations
-        if self.OPEN.empty():
-            return {"Allocations": {}, "Alloc_edges": [], "Cost": math.inf}
-
-        # Retrieve the next best solution from the queue
-        _, (includeE, excludeE, optimalSequences) = self.OPEN.get()
-        # Save the new solution in the list of solutions
-        self.Solutions[k] = (includeE, excludeE, optimalSequences)
-        # Return the optimal solution found
-        return optimalSequences
-
-    ######################################################### Solve tsp with constraints ###############################################################
-    def solve_tsp_with_constraints(self, includeE, excludeE):
+        # Rotation-aware costs between all positions, the unconstrained cost matrix and the rows of every location
+        self.rotationCostMatrix, self.baseCostMatrix = self.create_base_cost_matrices()
+        self.locRows = defaultdict(list)
+        for row, (loc, _) in enumerate(self.AllPosAndGoals):
+            self.locRows[loc].append(row)
+
+        # The E-GTSP files are written to a scratch directory of this run
+        self.solverIO = SolverIO(f"{os.getcwd()}/GLKH-1.1/GLKH", f"{self.configStr}_mEgtsp", ".gtsp",
+                                 solutionCacheDir=solutionCacheDir)
+
+    def lower_bound(self, includeE, excludeE):
+        # Assignment relaxation of the constrained E-GTSP over its sets (each agent, the 4 copies of each goal): every
+        # set chooses a distinct successor set, at the cheapest cost between their nodes, with the included edges
+        # priced as in invoke_GLKH. It never exceeds the cost of the subproblem's solution
+        cmat = self.create_cost_matrix(includeE, excludeE)
+        setStarts = np.r_[np.arange(len(self.Positions)), len(self.Positions) + 4 * np.arange(len(self.GoalLocations))]
+        setCosts = np.minimum.reduceat(np.minimum.reduceat(cmat, setStarts, axis=0), setStarts, axis=1)
+        np.fill_diagonal(setCosts, SELF_LOOP_COST)
+        rows, cols = linear_sum_assignment(setCosts)
+        return int(setCosts[rows, cols].sum()) + len(includeE) * 1000000
+
+    def solve_tsp_with_constraints(self, includeE, excludeE, tag=""):
         # Create the cost matrix
         costMatrix = self.create_cost_matrix(includeE, excludeE)
-        # Generate the mEgtsp input file
-        self.generate_EGTSP_problem_file(costMatrix)
-        # Run the LKH solver and return the result
-        return self.invoke_GLKH(includeE)
+        # Run the GLKH solver on the mEgtsp problem and return the result
+        return self.invoke_GLKH(self.generate_EGTSP_problem_lines(costMatrix), includeE, tag)
 
     ######################################################### Create cost matrix ###############################################################
+    def create_base_cost_matrices(self):
+        positions = self.AllPosAndGoals
+        rotationCosts = np.array([[self.cost_with_rotations.get((rowPos, colPos), 1000000) for colPos in positions]
+                                  for rowPos in positions], dtype=np.int64).reshape(len(positions), len(positions))
+
+        # Moving towards an agent's start position, or between copies of a location, is free
+        cmat = rotationCosts.copy()
+        cmat[:, :len(self.Positions)] = 0
+        locs = [loc for loc, _ in positions]
+        cmat[np.equal.outer(locs, locs)] = 0
+        return rotationCosts, cmat
+
     def create_cost_matrix(self, includeE, excludeE):
-        cmat = np.zeros((len(self.AllPosAndGoals), len(self.AllPosAndGoals)))
-        for row, (rowLoc, rowDirect) in enumerate(self.AllPosAndGoals):
-            for col, (colLoc, colDirect) in enumerate(self.AllPosAndGoals):
-
-                if rowLoc != colLoc:
-                    if (rowLoc, colLoc) in includeE:
-                        cmat[row, col] = -(
-                                1000000 - self.cost_with_rotations[((rowLoc, rowDirect), (colLoc, colDirect))])
-                    elif (rowLoc, colLoc) in excludeE:
-                        cmat[row, col] = 1000000
-                    elif (row < len(self.Positions) and col < len(self.Positions)) or (
-                            row >= len(self.Positions) > col):
-                        cmat[row, col] = 0
-                    else:
-                        cmat[row, col] = self.cost_with_rotations[((rowLoc, rowDirect), (colLoc, colDirect))]
+        # Excluded edges get a prohibitive cost and included edges (which take precedence) a very negative one, on
+        # every pair of rows and columns of their locations
+        cmat = self.baseCostMatrix.copy()
+        for rowLoc, colLoc in excludeE:
+            if rowLoc != colLoc:
+                cmat[np.ix_(self.locRows[rowLoc], self.locRows[colLoc])] = 1000000
+
+        for rowLoc, colLoc in includeE:
+            if rowLoc != colLoc:
+                edgeRows = np.ix_(self.locRows[rowLoc], self.locRows[colLoc])
+                cmat[edgeRows] = -(1000000 - self.rotationCostMatrix[edgeRows])
 
         return cmat
 
     ####################################################### Generate egtsp problem file ############################################################
-    def generate_EGTSP_problem_file(self, costMatrix):
+    def generate_EGTSP_problem_lines(self, costMatrix):
         nx, _ = costMatrix.shape
         totalSets = len(self.Positions) + len(self.GoalLocations)
         lines = [
@@ -147,51 +104,38 @@ class kBestSequencingWithGLKH:
             currSet += 1
             index += 4
 
-        with open(f"{os.getcwd()}/EGSTP_runtime_files/{self.configStr}_mEgtsp.gtsp", mode="w") as FileGtsp:
-            FileGtsp.writelines(lines)
+        return lines
 
     ############################################################# Invoke GLKH ####################################################################
-    def invoke_GLKH(self, includeE):
-        cmd = [f"{os.getcwd()}/GLKH-1.1/GLKH", f"{os.getcwd()}/EGSTP_runtime_files/{self.configStr}_mEgtsp.par"]
-        self.Counter_Solver_TSP_For_Test += 1
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        process.wait()
-
-        mEgtsp_tours = {"Allocations": {}, "Alloc_edges": []}
-
-        with open(f"{os.getcwd()}/EGSTP_runtime_files/{self.configStr}_mEgtsp.tour", mode="r") as FileTour:
-            lines = FileTour.readlines()
-            mEgtsp_tours["Cost"] = int(lines[1].split("=")[1])
-            ix = 6  # Starting index of the tour in the output file
-            val = int(lines[ix])
-            currAgentTour = []
-            agent = -1
-            first = True
-
-            # Read until the end of the tour
-            while val != -1:
-                goalLoc, _ = self.AllPosAndGoals[val - 1]
-                if first:
-                    agent = val - 1
-                    currAgentTour.append(goalLoc)
-                    first = False
-
-                # If it's a new agent
-                elif not first and val <= len(self.Positions):
-                    mEgtsp_tours["Allocations"][agent] = currAgentTour
-                    currAgentTour = [goalLoc]
-                    agent = val - 1
-                else:
-                    mEgtsp_tours["Alloc_edges"].append((currAgentTour[-1], goalLoc))
-                    currAgentTour.append(goalLoc)
-
-                ix = ix + 1
-                val = int(lines[ix])
-
-            # Add the final agent's tour
-            mEgtsp_tours["Allocations"][agent] = currAgentTour
-
-            mEgtsp_tours["Cost"] += (len(includeE) * 1000000)
+    def invoke_GLKH(self, problemLines, includeE, tag=""):
+        cost, tour = self.solverIO.solve(problemLines, tag)
+
+        mEgtsp_tours = {"Allocations": {}, "Alloc_edges": [], "Cost": cost}
+        currAgentTour = []
+        agent = -1
+        first = True
+
+        # Split the tour at the agents' nodes
+        for val in tour:
+            goalLoc, _ = self.AllPosAndGoals[val - 1]
+            if first:
+                agent = val - 1
+                currAgentTour.append(goalLoc)
+                first = False
+
+            # If it's a new agent
+            elif val <= len(self.Positions):
+                mEgtsp_tours["Allocations"][agent] = currAgentTour
+                currAgentTour = [goalLoc]
+                agent = val - 1
+            else:
+                mEgtsp_tours["Alloc_edges"].append((currAgentTour[-1], goalLoc))
+                currAgentTour.append(goalLoc)
+
+        # Add the final agent's tour
+        mEgtsp_tours["Allocations"][agent] = currAgentTour
+
+        mEgtsp_tours["Cost"] += (len(includeE) * 1000000)
 
         return mEgtsp_tours
 
@@ -236,10 +180,8 @@ class kBestSequencingWithGLKH:
         neighbors = []
         loc, direct = current_pos
 
-        direction_moves = (loc + 1, loc + self.MapAndDims["Cols"], loc - 1, loc - self.MapAndDims["Cols"])
-
-        loc_after_move = direction_moves[direct]
-        if self.validate_move(loc_after_move, loc):
+        loc_after_move = self.graph.neighbourList[loc][direct]
+        if loc_after_move >= 0:
             neighbors.append(((loc_after_move, direct), cost + 1))
 
         neighbors.append(((loc, (direct - 1) % 4), cost + 1))
@@ -247,28 +189,6 @@ class kBestSequencingWithGLKH:
 
         return neighbors
 
-    def validate_move(self, loc_after_move, loc):
-        # Extract the agent's location and direction before taking the next step
-
-        # If the agent is at the top or bottom boundary, it cannot move up or down
-        if not (0 <= loc_after_move < self.MapAndDims["Cols"] * self.MapAndDims["Rows"]):
-            return False
-
-        # If the agent is at the right boundary, it cannot move right
-        if loc % self.MapAndDims["Cols"] == self.MapAndDims["Cols"] - 1 and loc_after_move % \
-                self.MapAndDims["Cols"] == 0:
-            return False
-
-        # If the agent is at the left boundary, it cannot move left
-        if loc % self.MapAndDims["Cols"] == 0 and loc_after_move % self.MapAndDims["Cols"] == \
-                self.MapAndDims["Cols"] - 1:
-            return False
-
-        if self.MapAndDims["Map"][loc_after_move] != 0:
-            return False
-
-        return True
-
     def BFS_without_rotations(self, goal, dict_fo_h_val):
         visited = np.zeros(self.MapAndDims["Cols"] * self.MapAndDims["Rows"], dtype=bool)
         queue = deque([(goal, 0)])
@@ -287,12 +207,5 @@ class kBestSequencingWithGLKH:
                     queue.append((neighbor_loc, new_cost))
 
     def get_neighbors_for_bfs_without_rotations(self, current_loc, cost):
-        neighbors = []
-
-        for neighborLoc in [current_loc + 1, current_loc + self.MapAndDims["Cols"], current_loc - 1,
-                            current_loc - self.MapAndDims["Cols"]]:
-            if self.validate_move(neighborLoc, current_loc):
-                neighbors.append((neighborLoc, cost + 1))
-
-        return neighbors
+        return [(neighborLoc, cost + 1) for neighborLoc in self.graph.loc_neighbours(current_loc)]
 
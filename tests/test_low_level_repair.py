@@ -0,0 +1,130 @@
+import random
+from collections import defaultdict, deque
+
+import pytest
+
+from LowLevelPlan import LowLevelPlan
+from NodeStateConstClasses import ConstraintTable, Node
+
+
+def random_map(rng, rows, cols, density):
+    return {"Rows": rows, "Cols": cols, "Map": [1 if rng.random() < density else 0 for _ in range(rows * cols)]}
+
+
+def bfs_costs(MapAndDims):
+    # Shortest distances between every pair of free cells, as cost_without_rotations holds them
+    rows, cols, grid = MapAndDims["Rows"], MapAndDims["Cols"], MapAndDims["Map"]
+    costs = defaultdict(lambda: 1000000)
+    for source in (loc for loc in range(rows * cols) if grid[loc] == 0):
+        dist = {source: 0}
+        queue = deque([source])
+        while queue:
+            loc = queue.popleft()
+            for move in (1, -1, cols, -cols):
+                nextLoc = loc + move
+                if (0 <= nextLoc < rows * cols and grid[nextLoc] == 0 and nextLoc not in dist
+                        and not (abs(move) == 1 and nextLoc // cols != loc // cols)):
+                    dist[nextLoc] = dist[loc] + 1
+                    queue.append(nextLoc)
+        for loc, cost in dist.items():
+            costs[source, loc] = cost
+    return costs
+
+
+def child(parent, NewCons):
+    A = Node()
+    A.sequence = parent.sequence
+    A.g = parent.g
+    A.negConstraints[0] = parent.negConstraints[0] | {NewCons}
+    A.paths[0] = parent.paths[0][:]
+    return A
+
+
+def violations(path, constraints):
+    return [t for t in range(1, len(path)) if constraints.is_forbidden(t, path[t - 1][0], path[t][0])]
+
+
+@pytest.mark.parametrize("algorithm", ["RCbssEff", "IRC"])
+def test_repair_matches_the_full_replan(algorithm):
+    # Randomised parent paths, each given a constraint on one of its steps: the repair must succeed exactly when the
+    # full replan does, at the same cost, and respect the new constraint whenever the full replan does
+    rng = random.Random(15)
+    checked = repairs = 0
+    for _ in range(1500):
+        MapAndDims = random_map(rng, rng.randint(3, 8), rng.randint(3, 8), 0.2)
+        free = [loc for loc in range(MapAndDims["Rows"] * MapAndDims["Cols"]) if MapAndDims["Map"][loc] == 0]
+        if len(free) < 2:
+            continue
+        start = rng.choice(free)
+        sequence = [start] + rng.sample(free, min(len(free), rng.randint(1, 3)))
+        neg = {(0, rng.choice(free), rng.randint(1, 12)) for _ in range(rng.randint(0, 8))}
+
+        startPosition, costs, repairWindow = (start, rng.randrange(4)), bfs_costs(MapAndDims), rng.choice([1, 3, 8])
+        planner = LowLevelPlan(MapAndDims, [startPosition], costs, algorithm, repairWindow=repairWindow)
+        parent = Node()
+        parent.sequence = {"Allocations": {0: sequence}}
+        parent.negConstraints[0] = neg
+        if not planner.runLowLevelPlan(parent, [0]) or len(parent.paths[0]) < 2:
+            continue
+
+        path = parent.paths[0]
+        # Waits of the parent path are the steps a repair is most likely to get wrong
+        waits = [t for t in range(1, len(path)) if path[t][0] == path[t - 1][0]]
+        t = rng.choice(waits) if waits and rng.random() < 0.5 else rng.randint(1, len(path) - 1)
+        x = path[t][0] if rng.random() < 0.6 or path[t][0] == path[t - 1][0] else frozenset((path[t - 1][0], path[t][0]))
+        NewCons = (0, x, t)
+
+        replanned, repaired = child(parent, NewCons), child(parent, NewCons)
+        # A planner of its own, whose path cache cannot answer the repair with the replanned path
+        repairPlanner = LowLevelPlan(MapAndDims, [startPosition], costs, algorithm, repairWindow=repairWindow)
+        solved = planner.runLowLevelPlan(replanned, [0])
+        assert repairPlanner.runLowLevelRepair(repaired, NewCons) == solved
+        if not solved:
+            continue
+
+        assert repaired.g == replanned.g == len(repaired.paths[0]) - 1
+        assert repaired.paths[0][0] == path[0]
+        newConstraint = ConstraintTable(0, {NewCons}, set())
+        if not violations(replanned.paths[0], newConstraint):
+            assert not violations(repaired.paths[0], newConstraint)
+        checked += 1
+        repairs += repairPlanner.Counter_Repairs
+
+    assert checked > 100 and repairs > 50
+
+
+def test_repair_is_not_longer_than_the_full_replan():
+    # The parent path costs 13 and the full replan 11: pruning the repair at the parent cost used to return a path
+    # of cost 12
+    MapAndDims = {"Rows": 6, "Cols": 5, "Map": [0, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1,
+                                                1, 0, 1, 0, 0, 1, 0, 0, 0, 0]}
+    for repairWindow in (3, 8):
+        planner = LowLevelPlan(MapAndDims, [(26, 1)], bfs_costs(MapAndDims), "RCbssEff", repairWindow=repairWindow)
+        parent = Node()
+        parent.sequence = {"Allocations": {0: [26, 23, 16]}}
+        parent.negConstraints[0] = {(0, 12, 9), (0, 18, 8), (0, 23, 5)}
+        assert planner.runLowLevelPlan(parent, [0]) and parent.g == 13
+
+        NewCons = (0, 13, 8)
+        replanned, repaired = child(parent, NewCons), child(parent, NewCons)
+        assert LowLevelPlan(MapAndDims, [(26, 1)], bfs_costs(MapAndDims), "RCbssEff").runLowLevelPlan(replanned, [0])
+        assert planner.runLowLevelRepair(repaired, NewCons)
+        assert replanned.g == repaired.g == 11
+
+
+def test_repair_does_not_wait_into_the_forbidden_cell():
+    # The parent path waits at 5 over times 4-5, its move to 1 being forbidden at time 5. Forbidding 5 at time 5 too
+    # used to let the repair wait there anyway and rejoin the parent path unchanged
+    MapAndDims = {"Rows": 5, "Cols": 4, "Map": [0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 1, 0]}
+    neg = {(0, 0, 5), (0, 1, 5), (0, 10, 3), (0, 13, 7), (0, 13, 9), (0, 2, 4), (0, 3, 5), (0, 6, 5), (0, 7, 2)}
+    planner = LowLevelPlan(MapAndDims, [(13, 1)], bfs_costs(MapAndDims), "IRC", repairWindow=1)
+    parent = Node()
+    parent.sequence = {"Allocations": {0: [13, 1, 3]}}
+    parent.negConstraints[0] = neg
+    assert planner.runLowLevelPlan(parent, [0])
+    assert parent.paths[0] == [(13, 1), (14, 1), (10, 1), (6, 1), (5, 1), (5, 1), (1, 1), (2, 1), (3, 1)]
+
+    NewCons = (0, 5, 5)
+    repaired = child(parent, NewCons)
+    assert planner.runLowLevelRepair(repaired, NewCons)
+    assert not violations(repaired.paths[0], ConstraintTable(0, {NewCons}, set()))
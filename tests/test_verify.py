@@ -0,0 +1,80 @@
+import random
+
+import numpy as np
+
+from Verify import create_path_arrays, simulate_batch
+
+
+def random_walk(rng, rows, cols, length):
+    # Path of (loc, direction) steps on an open grid, each step waiting or moving to a neighbouring cell
+    loc = rng.randrange(rows * cols)
+    path = [(loc, 0)]
+    for _ in range(length):
+        row, col = divmod(loc, cols)
+        moves = [(row + dRow, col + dCol) for dRow, dCol in ((0, 0), (0, 1), (0, -1), (1, 0), (-1, 0))]
+        row, col = rng.choice([(r, c) for r, c in moves if 0 <= r < rows and 0 <= c < cols])
+        loc = row * cols + col
+        path.append((loc, 0))
+    return path
+
+
+def simulate_scalar(paths, moves):
+    # The former per-simulation loop of Verify.run_s_simulations, with the draws of random.Random replaced by
+    # moves[sim, tick, agent]. Returns a collision flag per simulation
+    agents = list(paths.keys())
+    collisions = []
+    for sim in range(moves.shape[0]):
+        paths_copy = {agent: list(path) for agent, path in paths.items()}
+        active_agents = {agent for agent, path in paths_copy.items() if len(path) > 1}
+        collision = False
+        tick = 0
+
+        while active_agents:
+            locsAndEdge = set()
+            finish_agents = set()
+
+            for agent, path in paths_copy.items():
+                lastLoc = path[0][0]
+                if len(path) != 1 and moves[sim, tick, agents.index(agent)]:
+                    path.pop(0)
+
+                loc = path[0][0]
+                if loc in locsAndEdge or (loc, lastLoc) in locsAndEdge:
+                    collision = True
+                    break
+                locsAndEdge.add(loc)
+                locsAndEdge.add((lastLoc, loc))
+
+                if len(path) == 1:
+                    finish_agents.add(agent)
+
+            if collision:
+                break
+            active_agents -= finish_agents
+            tick += 1
+
+        collisions.append(collision)
+    return np.array(collisions)
+
+
+def test_simulate_batch_matches_the_scalar_simulation():
+    # Same move matrix, same collision outcome for every simulation, on small grids where collisions and swaps abound
+    rng = random.Random(1)
+    numpyRng = np.random.default_rng(1)
+    outcomes = []
+    for _ in range(200):
+        rows, cols = rng.randint(2, 4), rng.randint(2, 4)
+        paths = {agent: random_walk(rng, rows, cols, rng.randint(0, 10)) for agent in range(rng.randint(2, 5))}
+        if all(len(path) == 1 for path in paths.values()):
+            continue
+        numSims = 64
+        moves = numpyRng.random((numSims, 1024, len(paths))) > rng.choice([0.1, 0.3, 0.6])
+
+        expected = simulate_scalar(paths, moves)
+        collision = simulate_batch(create_path_arrays(paths, list(paths.keys())),
+                                   lambda firstTick, numTicks: moves[:, firstTick:firstTick + numTicks], numSims)
+        assert collision.tolist() == expected.tolist()
+        outcomes.extend(expected.tolist())
+
+    # Both outcomes are well represented
+    assert 0.1 < np.mean(outcomes) < 0.9